@@ -0,0 +1,245 @@
+import json
+import os
+import re
+import sys
+import time
+import random
+import shutil
+import tempfile
+import argparse
+import subprocess
+
+# benchmark of the whole translate.py flow on synthetic whisper transcripts, with the offline stub backend
+# python3 bench.py --sizes 10m,1h,5h,20h --save      # store the baselines
+# python3 bench.py --sizes 10m,1h,5h,20h --compare   # fail if slower or bigger than the baselines
+
+translate_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'translate.py')
+
+words = (
+    'the committee will now hear testimony about artificial intelligence and its risks to society '
+    'we have seen how algorithmic biases can perpetuate discrimination and prejudice in hiring lending and housing '
+    'companies should be transparent about the data they use to train their models and how those models are tested '
+    'I think that is a very important question and I want to thank you for raising it here today senator'
+).split()
+
+# the patterns the sentence counting and line breaking have to deal with
+specials = [
+    'Mr. Altman', 'Dr. Marcus', 'the U.S. government', 'St. Louis', 'A.I. systems', 'Howard K. Smith',
+    '3.5 percent', '88.6%', '35,000 people', '1,200,000 dollars', 'well...', 'GPT-4'
+]
+
+
+def parse_args():
+    """
+        parse arguments
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=str, default='10m,1h,5h', help="comma separated durations of the synthetic transcripts, such as 10m,1h,20h")
+    parser.add_argument("--seed", type=int, default=1, help="random seed of the synthetic transcripts")
+    parser.add_argument("--baselines", type=str, default='bench_baselines.json', help="the baselines file")
+    parser.add_argument("--save", action="store_true", help="save the results as the baselines")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the baselines, exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown or memory growth against the baselines, 0.2 for 20%%")
+    parser.add_argument("--repeats", type=int, default=3, help="runs of each size, the best time of each stage is kept")
+    parser.add_argument("--min-seconds", type=float, default=0.1, help="stages faster than this in the baseline are too noisy to compare")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directories")
+    args = parser.parse_args()
+    return args
+
+
+def parse_duration(duration):
+    """
+        "10m" to 600, "20h" to 72000, "90s" or "90" to 90
+        Return: int, seconds
+    """
+    m = re.match(r'^(\d+(?:\.\d+)?)([smh]?)$', duration.strip())
+    if m is None:
+        raise ValueError('parse_duration: invalid duration %s' % duration)
+    return int(float(m.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[m.group(2)])
+
+
+def make_sentence(rng):
+    """
+        one English sentence with some of the specials, ended by . ? ! or ...
+    """
+    tokens = [rng.choice(words) for _ in range(rng.randint(6, 24))]
+    for _ in range(rng.choice((0, 0, 1, 1, 2))):
+        tokens.insert(rng.randint(0, len(tokens)), rng.choice(specials))
+    sentence = ' '.join(tokens)
+    sentence = sentence[0].upper() + sentence[1:]
+    if rng.random() < 0.3:
+        half = len(sentence) // 2
+        comma = sentence.find(' ', half)
+        if comma > 0:
+            sentence = sentence[:comma] + ',' + sentence[comma:]
+    return sentence + rng.choice(('.', '.', '.', '.', '?', '!', '...'))
+
+
+def make_whisper(seconds, seed = 1):
+    """
+        synthetic whisper json of about seconds long, the sentences are cut into segments of 2 to 7 seconds
+        at arbitrary word boundaries, like whisper does
+        Return: dict
+    """
+    rng = random.Random(seed)
+    segments = []
+    now = 0.0
+    pending = []  # words not yet in a segment
+    while now < seconds:
+        while len(pending) < 30:
+            pending.extend(make_sentence(rng).split(' '))
+        n = rng.randint(5, 18)
+        text = ' ' + ' '.join(pending[:n])
+        pending = pending[n:]
+        duration = round(rng.uniform(2.0, 7.0), 2)
+        segments.append({
+            'id': len(segments),
+            'seek': int(now * 100),
+            'start': now,
+            'end': now + duration,
+            'text': text,
+            'tokens': [rng.randint(200, 50000) for _ in range(n + 2)],
+            'temperature': 0.0,
+            'avg_logprob': -rng.random() / 3,
+            'compression_ratio': 1 + rng.random(),
+            'no_speech_prob': rng.random() / 50
+        })
+        now += duration
+    return {
+        'text': ''.join(segment['text'] for segment in segments),
+        'segments': segments,
+        'language': 'en'
+    }
+
+
+def run_size(duration, seed = 1, keep = False):
+    """
+        run translate.py with the stub backend on a synthetic transcript in a temporary directory
+        Return: dict, the metrics
+    """
+    seconds = parse_duration(duration)
+    work_dir = tempfile.mkdtemp(prefix = 'bench_%s_' % duration)
+    try:
+        whisper = make_whisper(seconds, seed = seed)
+        json_whisper = os.path.join(work_dir, 'whisper.json')
+        with open(json_whisper, 'w') as fp:
+            json.dump(whisper, fp)
+        cues = len(whisper['segments'])
+        chars = sum(len(segment['text']) for segment in whisper['segments'])
+        del whisper
+
+        command = [sys.executable, translate_py, '-s', 'whisper.json', '-b', 'stub', '--no-cache', '--fresh', '--profile']
+        start = time.time()
+        with open(os.path.join(work_dir, 'log.txt'), 'w') as log:
+            proc = subprocess.Popen(command, cwd = work_dir, stdout = log, stderr = subprocess.STDOUT)
+            _, status, rusage = os.wait4(proc.pid, 0)  # the rusage of this run only
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        wall = time.time() - start
+        if proc.returncode != 0:
+            raise RuntimeError('translate.py failed on %s, see %s' %(duration, os.path.join(work_dir, 'log.txt')))
+        with open(os.path.join(work_dir, 'translated', 'profile.json'), 'r') as fp:
+            profile = json.load(fp)
+
+        maxrss = rusage.ru_maxrss if sys.platform != 'darwin' else rusage.ru_maxrss // 1024  # KB
+        result = {
+            'cues': cues,
+            'chars': chars,
+            'wall_seconds': round(wall, 3),
+            'peak_memory_mb': round(maxrss / 1024.0, 1),
+            'stages': {}
+        }
+        for name, info in profile['stages'].items():
+            stage_seconds = max(info['seconds'], 1e-6)
+            result['stages'][name] = {
+                'seconds': round(info['seconds'], 4),
+                'cues_per_second': round(cues / stage_seconds, 1),
+                'chars_per_second': round(chars / stage_seconds, 1)
+            }
+        return result
+    finally:
+        if keep:
+            print('kept %s' % work_dir)
+        else:
+            shutil.rmtree(work_dir, ignore_errors = True)
+
+
+def best_of(results):
+    """
+        the best of several runs of one size: the shortest time of each stage and of the wall, the smallest peak memory,
+        as the noise of a shared machine only makes a run slower
+        Return: dict, see run_size
+    """
+    best = dict(results[0])
+    best['wall_seconds'] = min(result['wall_seconds'] for result in results)
+    best['peak_memory_mb'] = min(result['peak_memory_mb'] for result in results)
+    best['stages'] = {}
+    for name in results[0]['stages']:
+        runs = [result['stages'][name] for result in results if name in result['stages']]
+        best['stages'][name] = min(runs, key = lambda info: info['seconds'])
+    return best
+
+
+def print_result(duration, result):
+    print('%s: %d cues, %d chars, wall %.2f s, peak memory %.1f MB' %(duration, result['cues'], result['chars'], result['wall_seconds'], result['peak_memory_mb']))
+    print('    %-12s %10s %14s %14s' %('stage', 'seconds', 'cues/s', 'chars/s'))
+    for name, info in result['stages'].items():
+        print('    %-12s %10.3f %14.1f %14.1f' %(name, info['seconds'], info['cues_per_second'], info['chars_per_second']))
+
+
+def compare(results, baselines, tolerance = 0.2, min_seconds = 0.1):
+    """
+        Return: list of str, the regressions: a stage slower in chars/s, the wall time longer or the peak memory bigger, by more than tolerance;
+            the stages taking less than min_seconds in the baseline are not compared, their timings are mostly noise
+    """
+    regressions = []
+    for duration, result in results.items():
+        baseline = baselines.get(duration)
+        if baseline is None:
+            print('%s: no baseline' % duration)
+            continue
+        for name, info in result['stages'].items():
+            base_info = baseline['stages'].get(name)
+            if base_info is None or base_info['seconds'] < min_seconds:
+                continue
+            if info['chars_per_second'] < base_info['chars_per_second'] * (1 - tolerance):
+                regressions.append('%s %s: %.1f chars/s, baseline %.1f' %(duration, name, info['chars_per_second'], base_info['chars_per_second']))
+        if result['wall_seconds'] > baseline['wall_seconds'] * (1 + tolerance):
+            regressions.append('%s wall: %.2f s, baseline %.2f s' %(duration, result['wall_seconds'], baseline['wall_seconds']))
+        if result['peak_memory_mb'] > baseline['peak_memory_mb'] * (1 + tolerance):
+            regressions.append('%s peak memory: %.1f MB, baseline %.1f MB' %(duration, result['peak_memory_mb'], baseline['peak_memory_mb']))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    results = {}
+    for duration in args.sizes.split(','):
+        duration = duration.strip()
+        results[duration] = best_of([run_size(duration, seed = args.seed, keep = args.keep) for _ in range(max(args.repeats, 1))])
+        print_result(duration, results[duration])
+
+    if args.compare:
+        if not os.path.exists(args.baselines):
+            print('baselines not found: %s' % args.baselines)
+            sys.exit(1)
+        with open(args.baselines, 'r') as fp:
+            baselines = json.load(fp)
+        regressions = compare(results, baselines, tolerance = args.tolerance, min_seconds = args.min_seconds)
+        for regression in regressions:
+            print('regression: %s' % regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+        print('no regression.')
+    if args.save:
+        baselines = {}
+        if os.path.exists(args.baselines):
+            with open(args.baselines, 'r') as fp:
+                baselines = json.load(fp)
+        baselines.update(results)
+        with open(args.baselines, 'w') as fp:
+            json.dump(baselines, fp, indent=4)
+        print('baselines saved: %s' % args.baselines)
+
+
+if __name__ == "__main__":
+    main()
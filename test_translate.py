@@ -0,0 +1,397 @@
+import argparse
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+
+import pytest
+
+import translate
+
+# python3 -m pytest -q test_translate.py
+
+
+def naive_find(terms, text):
+    return sorted(
+        (start, start + len(term), index)
+        for index, term in enumerate(terms)
+        for start in range(len(text) - len(term) + 1)
+        if term and text.startswith(term, start)
+    )
+
+
+def test_term_matcher_finds_overlapping_terms():
+    matcher = translate.TermMatcher(['he', 'she', 'his', 'hers'])
+    assert sorted(matcher.finditer('ushers')) == [(1, 4, 1), (2, 4, 0), (2, 6, 3)]
+    assert matcher.find('ushers') == [(1, 4, 1)]
+
+
+def test_term_matcher_whole_word():
+    matcher = translate.TermMatcher(['GPT', 'GPT-4'], whole_word = True)
+    assert matcher.find('GPT-4 and GPTs, not GPT') == [(0, 5, 1), (20, 23, 0)]
+
+
+def test_term_matcher_against_naive_search():
+    rng = random.Random(1)
+    for _ in range(300):
+        terms = [''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 8))]
+        text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 40)))
+        assert sorted(translate.TermMatcher(terms).finditer(text)) == naive_find(terms, text)
+
+
+def test_sentence_segmenter_long_abbreviation_list():
+    abbreviations = list(translate.SentenceSegmenter.abbreviations) + ['Abbr%d.' % i for i in range(3000)]
+    segmenter = translate.SentenceSegmenter(abbreviations)
+    for text in ('Mr. Altman, thank you.', 'The U.S. government will act. Then we vote.', 'Howard K. Smith spoke. Dr. K. Smith too.', 'Wait... what?'):
+        assert segmenter.boundaries(text) == translate.segmenter.boundaries(text), text
+    assert segmenter.boundaries('See Abbr2999. for more. Done.') == [23, 29]
+
+
+def test_adaptive_sizer_ignores_small_requests(tmp_path):
+    path = str(tmp_path / 'chunk_sizes.json')
+    sizer = translate.AdaptiveSizer(path = path, backend = translate.StubBackend(), size = 4000)
+    for _ in range(10):
+        sizer.observe(5, 0.001)  # a tiny file, its requests say nothing of the size
+    assert sizer.size == 4000
+    sizer.save()
+    assert translate.AdaptiveSizer(path = path, backend = translate.StubBackend(), size = 4000).size == 4000
+
+
+def test_adaptive_sizer_best_size_needs_samples(tmp_path):
+    path = str(tmp_path / 'chunk_sizes.json')
+    sizer = translate.AdaptiveSizer(path = path, backend = translate.StubBackend(), size = 2000)
+    sizer.observe(2000, 0.01)  # one fast sample of 2000, then the size grows to 2500
+    assert sizer.size == 2500
+    assert sizer.best_size() is None
+    for _ in range(2):
+        sizer.size = 2000
+        sizer.observe(2000, 0.01)
+    assert sizer.best_size() == 2000
+    sizer.save()
+    assert translate.AdaptiveSizer(path = path, backend = translate.StubBackend(), size = 500).size == 2000
+
+
+def test_adaptive_sizer_shrinks_on_slow_and_failed_requests():
+    sizer = translate.AdaptiveSizer(backend = translate.StubBackend(), size = 4000, latency_budget = 1.0)
+    sizer.observe(4000, 2.0)
+    assert sizer.size == 3000
+    sizer.failed(3000)
+    assert sizer.size == 1500
+
+
+# the sentence ends found by the regex SentenceSegmenter, before it used TermMatcher
+old_boundaries = [
+    ('Thank you.', [10]),
+    ('Mr. Altman, thank you.', [22]),
+    ('The U.S. government will act. Then we vote.', [29, 43]),
+    ('It grew 3.5 percent.', [20]),
+    ('Howard K. Smith spoke. Dr. K. Smith too.', [22, 40]),
+    ('Is that right? Yes! Well...', [14, 19, 27]),
+    ('A.I. systems are tested.', [24]),
+    ('St. Louis is a city. Dr. Marcus agrees.', [20, 39]),
+    ('no end here', []),
+    ('88.6% of people agree.', [22]),
+    ('So US. policy changed.', [22]),
+    ('One. Two. Three.', [4, 9, 16]),
+    ('He said Mr. Smith. Then left.', [18, 29]),
+    ('Wait... what?', [7, 13]),
+    ('Version 4.0 ships. OK', [18]),
+    ('I met John F. Kennedy.', [22]),
+    ('', []),
+    ('Ms. Jones is here.', [3, 18]),
+    ('The A.I. and the U.S. met.', [26])
+]
+
+
+def test_sentence_segmenter_keeps_the_old_boundaries():
+    for text, boundaries in old_boundaries:
+        assert translate.segmenter.boundaries(text) == boundaries, text
+        assert translate.judge_sentence_en_2(text) == len(boundaries), text
+
+
+def test_align_sentences_miscounted_cue():
+    # the segmenter counted two sentence ends in the second cue, the translation has one sentence there
+    spans, confidences = translate.align_sentences(counts = [1, 2, 1, 1], en_lengths = [20, 40, 10, 30], zh_lengths = [10, 20, 5, 15])
+    assert spans == [(0, 1), (1, 2), (2, 3), (3, 4)]
+    assert confidences[1] < 0.5
+    assert confidences[0] == confidences[2] == confidences[3] == 1.0
+
+
+def test_align_sentences_miscount_does_not_shift_the_rest():
+    counts = [1] * 60 + [2] + [1] * 60
+    en_lengths = [20] * 60 + [40] + [30] * 60
+    zh_lengths = [10] * 60 + [20] + [15] * 60
+    spans, _ = translate.align_sentences(counts = counts, en_lengths = en_lengths, zh_lengths = zh_lengths, band = 3)
+    assert spans == [(i, i + 1) for i in range(121)]
+
+
+def test_align_sentences_empty_translation():
+    for zh_lengths in ([], [0], [0, 0]):
+        spans, confidences = translate.align_sentences(counts = [1, 1], en_lengths = [10, 12], zh_lengths = zh_lengths)
+        assert len(spans) == len(confidences) == 2
+        assert spans[0][0] == 0 and spans[-1][1] == len(zh_lengths)
+    spans, _ = translate.align_sentences(counts = [1], en_lengths = [0], zh_lengths = [5])
+    assert spans == [(0, 1)]
+
+
+def test_iter_segments_small_chunks(tmp_path):
+    whisper = {
+        'text': ' He said "hi" \\ bye. 你好 ]}',
+        'segments': [
+            {'id': 0, 'seek': 0, 'start': 0.0, 'end': 2.5, 'text': ' He said "hi" \\ bye.', 'tokens': [1, 2, [3, {'x': '}'}]], 'avg_logprob': -0.1},
+            {'id': 1, 'seek': 250, 'start': 2.5, 'end': 4.0, 'text': ' 你好 ]}', 'tokens': [], 'no_speech_prob': 1e-05}
+        ],
+        'language': 'en'
+    }
+    path = tmp_path / 'whisper.json'
+    path.write_text(json.dumps(whisper, indent = 2, ensure_ascii = False), encoding = 'utf-8')
+    expected = [{key: segment[key] for key in ('id', 'start', 'end', 'text')} for segment in whisper['segments']]
+    for chunk_size in (1, 2, 3, 7, 64, 1024 * 1024):
+        assert list(translate.iter_segments(str(path), chunk_size = chunk_size)) == expected
+
+
+def test_iter_segments_no_segments(tmp_path):
+    path = tmp_path / 'whisper.json'
+    path.write_text('{"text": "", "segments": [], "language": "en"}')
+    assert list(translate.iter_segments(str(path), chunk_size = 2)) == []
+
+
+def random_subtitle(rng):
+    pieces = ['the', 'committee', 'AI', '35,000', 'H100', '人工智能', '风险', '，', '。', '我们', '3.5', 'GPT-4', '？', '（测试）']
+    text = ''
+    for _ in range(rng.randint(1, 30)):
+        piece = rng.choice(pieces)
+        text += piece if rng.random() < 0.5 or piece in '，。？' else ' ' + piece
+    return text.strip()
+
+
+def test_break_lines_two_line_shortcut_matches_the_dynamic_programming():
+    rng = random.Random(2)
+    for _ in range(2000):
+        text = random_subtitle(rng)
+        max_width = rng.choice((16, 24, 50))
+        widths = [0]
+        for char in text:
+            widths.append(widths[-1] + translate.char_width(char))
+        if widths[-1] <= max_width:
+            continue
+        width = max(max_width, -(-widths[-1] // 2))
+        expected = translate.layout_lines(text, widths, translate.break_candidates(text), width, 2)
+        assert translate.break_lines(text, max_width = max_width, max_lines = 2) == expected, text
+
+
+def test_break_lines_keeps_numbers_and_fits():
+    text = '委员会今天听取了关于人工智能风险的证词，我们看到了35,000人参与，H100芯片的出口也受到限制。'
+    lines = translate.break_lines(text, max_width = 30, max_lines = 3).split('\n')
+    assert ''.join(lines) == text
+    assert all(translate.display_width(line) <= 30 for line in lines)
+    assert any('35,000' in line for line in lines)
+    assert any('H100' in line for line in lines)
+    assert translate.break_lines('short', max_width = 30) == 'short'
+
+
+def test_stub_backend_keeps_the_english_sentences():
+    text = 'Mr. Altman spoke. The U.S. and A.I. grew 3.5 percent! Howard K. Smith? Well... ok'
+    translated = translate.StubBackend().translate_batch([text], dest = 'zh-cn')[0]
+    assert translated == 'Mr· Altman spoke。The U·S· and A·I· grew 3.5 percent！Howard K· Smith？Well……ok'
+    assert len(translate.split_sentences_zh(translated)[0]) == len(translate.segmenter.split(text))
+    assert translate.StubBackend().translate_batch([text], dest = 'es') == [text]
+
+
+class BlockedBackend(translate.TranslatorBackend):
+    name = 'blocked'
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def translate_batch(self, texts, src = 'en', dest = 'zh-cn'):
+        self.calls += 1
+        self.release.wait(5)
+        return list(texts)
+
+
+def test_live_cues_do_not_queue_behind_late_translations():
+    backend = BlockedBackend()
+    segments = queue.Queue()
+    for i in range(3):
+        segments.put(({'start': i, 'end': i + 1, 'text': ' Sentence %d.' % i}, time.monotonic()))
+    segments.put(None)
+    try:
+        cues = list(translate.live_cues(segments, {'backend': backend}, deadline = 0.05, in_flight = 1))
+    finally:
+        backend.release.set()
+    assert [cue.cn_subtitle for cue in cues] == ['Sentence 0.', 'Sentence 1.', 'Sentence 2.']
+    assert backend.calls == 1
+
+
+def test_group_texts_within_the_limit():
+    groups = list(translate.group_texts(['a' * 25 + '.', 'b' * 20, 'c' * 40, 'd' * 5], chars_limit = 50))
+    assert [group for group, _ in groups] == [['a' * 25 + '.'], ['b' * 20], ['c' * 40, 'd' * 5]]
+    rng = random.Random(4)
+    for _ in range(300):
+        texts = [rng.choice(('x' * rng.randint(1, 30), 'y' * rng.randint(1, 30) + '.')) for _ in range(rng.randint(1, 30))]
+        groups = list(translate.group_texts(texts, chars_limit = 60))
+        assert [text for group, _ in groups for text in group] == texts
+        for group, chars in groups:
+            assert chars == len(' '.join(group))
+            assert chars <= 60 or len(group) == 1
+
+
+def test_split_repeats():
+    texts = [' Hello there.', ' Thank you.', ' We go on', ' and on.', ' Thank you.', ' Mr.', ' Thank you.']
+    assert translate.split_repeats(texts) == [[' Hello there.'], [' Thank you.'], [' We go on', ' and on.'], [' Thank you.'], [' Mr.', ' Thank you.']]
+    assert translate.split_repeats([' One.', ' Two.']) == [[' One.', ' Two.']]
+
+
+def test_deduplicator_release_fails_the_waiters():
+    dedup = translate.Deduplicator()
+    futures, owned = dedup.claim(['Thank you.', 'Other.'], 'en', 'zh-cn', 'stub')
+    waiting, waiting_owned = dedup.claim([' Thank  you. '], 'en', 'zh-cn', 'stub')
+    assert len(owned) == 2 and waiting_owned == {}
+    assert waiting[0] is futures[0]
+    dedup.release(owned, RuntimeError('down'))
+    try:
+        waiting[0].result(timeout = 1)
+        assert False, 'the waiter should get the error of the owner'
+    except RuntimeError as e:
+        assert str(e) == 'down'
+    again, again_owned = dedup.claim(['Thank you.'], 'en', 'zh-cn', 'stub')  # released, so sent again
+    assert len(again_owned) == 1
+    dedup.resolve(list(again_owned)[0], '谢谢。')
+    assert again[0].result() == '谢谢。'
+
+
+class CountingBackend(translate.StubBackend):
+    def __init__(self):
+        super(CountingBackend, self).__init__()
+        self.sent = []
+
+    def translate_batch(self, texts, src = 'en', dest = 'zh-cn'):
+        self.sent.extend(texts)
+        return super(CountingBackend, self).translate_batch(texts, src = src, dest = dest)
+
+
+def test_translate_sends_a_repeated_sentence_once():
+    texts = [' Hello there.', ' Thank you.', ' We go on', ' and on.', ' Thank you.', ' Thank you.']
+    backend = CountingBackend()
+    dedup = translate.Deduplicator()
+    new_infos, _ = translate.translate([translate.make_group(texts, len(' '.join(texts)), len(texts))], backend = backend, dedup = dedup)
+    assert backend.sent.count('Thank you.') + backend.sent.count(' Thank you.') == 1
+    assert dedup.duplicates == 2
+    assert len(translate.split_sentences_zh(new_infos[0]['joined_translated'])[0]) == 5
+
+
+def test_translation_cache_evicts_the_least_recently_used(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = translate.TranslationCache(path, max_bytes = 1000)
+    cache.put('first', 'en', 'zh-cn', 'stub', 'x' * 20)
+    time.sleep(0.01)
+    cache.put_many([('text %03d' % i, 'target %03d' % i) for i in range(20)], 'en', 'zh-cn', 'stub')  # 18 bytes each
+    time.sleep(0.01)
+    assert cache.get('text 000', 'en', 'zh-cn', 'stub') == 'target 000'  # used again, so it is kept
+    for i in range(20, 60):
+        cache.put('text %03d' % i, 'en', 'zh-cn', 'stub', 'target %03d' % i)
+    assert cache.size <= 1000
+    assert cache.size == cache.conn.execute('SELECT SUM(size) FROM translations').fetchone()[0]
+    assert cache.get('text 000', 'en', 'zh-cn', 'stub') == 'target 000'
+    assert cache.get('first', 'en', 'zh-cn', 'stub') is None
+    assert cache.get_many(['text 059', ' text  059 ', 'missing'], 'en', 'zh-cn', 'stub') == ['target 059', 'target 059', None]
+    assert cache.get('text 059', 'en', 'ja', 'stub') is None
+    size = cache.size
+    cache.close()
+    assert translate.TranslationCache(path, max_bytes = 1000).size == size
+
+
+def test_translation_cache_evicts_below_the_limit(tmp_path):
+    cache = translate.TranslationCache(str(tmp_path / 'cache.sqlite'), max_bytes = 1000)
+    for i in range(56):
+        cache.put('text %03d' % i, 'en', 'zh-cn', 'stub', 'target %03d' % i)  # 1008 bytes, over by one
+    assert cache.size <= 1000 * translate.TranslationCache.low_water
+
+
+def timeline_cue(order, start_ms, end_ms, text, cn_subtitle):
+    cue = translate.Cue(order = order, start_ms = start_ms, end_ms = end_ms, text = text)
+    cue.cn_subtitle = cn_subtitle
+    cue.confidence = 1.0
+    return cue
+
+
+needs_numpy = pytest.mark.skipif(translate.np is None, reason = 'the timeline stage needs numpy')
+
+
+@needs_numpy
+def test_fix_timeline_splits_within_the_cue():
+    long_cue = timeline_cue(1, 0, 20000, ' one two three four five six seven eight nine ten eleven twelve', '一二三四五六七八九十')
+    cues = translate.fix_timeline([long_cue, timeline_cue(2, 5000, 9000, ' second cue here', '第二个。')])
+    assert [(cue.start_ms, cue.end_ms, cue.text) for cue in cues] == [(0, 5000, long_cue.text), (5000, 9000, ' second cue here')]
+    assert long_cue.end_ms == 20000  # not changed
+
+
+@needs_numpy
+def test_fix_timeline_rules():
+    cues = translate.fix_timeline([
+        timeline_cue(1, 0, 500, ' Hi.', '你好。'),
+        timeline_cue(2, 520, 1200, ' Yes.', '是的。'),
+        timeline_cue(3, 1100, 16000, ' This is a very long cue that goes on and on. And it has a second sentence in it.', '这是一个很长的字幕。\r\n它还有第二句话。'),
+        timeline_cue(4, 16050, 17000, ' ok so', '正在进行的句子'),
+        timeline_cue(5, 30500, 30600, ' end', '结束。')
+    ])
+    assert (cues[0].start_ms, cues[0].end_ms, cues[0].text, cues[0].cn_subtitle) == (0, 1100, ' Hi. Yes.', '你好。\r\n是的。')  # short cues merged
+    assert [cue.order for cue in cues] == list(range(1, len(cues) + 1))
+    assert cues[-1].end_ms - cues[-1].start_ms == 1000  # min duration
+    assert [cue.start_ms for cue in cues[1:5]] == [1100, cues[1].end_ms, cues[2].end_ms, 16050]  # split within its own time
+    assert ''.join(cue.cn_subtitle for cue in cues[1:4]) == '这是一个很长的字幕。它还有第二句话。'
+
+
+@needs_numpy
+def test_fix_timeline_random_cues():
+    rng = random.Random(3)
+    for _ in range(200):
+        cues = []
+        for i in range(rng.randint(1, 30)):
+            start_ms = rng.randint(0, 100000)
+            text = ' ' + ' '.join(rng.choice(('word', 'a', 'longer')) for _ in range(rng.randint(1, 25)))
+            cues.append(timeline_cue(i + 1, start_ms, start_ms + rng.randint(-500, 25000), text, rng.choice(('句子。', '很长的句子。\r\n第二句。', ''))))
+        fixed = translate.fix_timeline(cues)
+        for cue, next_cue in zip(fixed, fixed[1:]):
+            assert cue.start_ms <= cue.end_ms <= next_cue.start_ms
+        assert all(cue.end_ms - cue.start_ms <= 7000 for cue in fixed)
+
+
+def test_bulk_times_match_format_times():
+    starts = [0, 5, 999, 61000, 3723456]
+    ends = [10, 1005, 1999, 3599999, 99999999]
+    for fmt in ('srt', 'vtt', 'ass', 'jsonl'):
+        assert translate.bulk_times(fmt, starts, ends) == [translate.format_times(fmt, start_ms, end_ms) for start_ms, end_ms in zip(starts, ends)]
+
+
+def test_service_replies_with_job_copies(tmp_path):
+    json_whisper = tmp_path / 'talk.json'
+    json_whisper.write_text('{"segments": []}')
+    service = translate.Service(argparse.Namespace(queue_size = 2, poll = 1.0), translate.StubBackend())
+    server = service.make_server(0)
+    threading.Thread(target = server.serve_forever, daemon = True).start()
+
+    def request(method, body = None):
+        connection = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout = 5)
+        connection.request(method, '/jobs', body = None if body is None else json.dumps(body))
+        response = connection.getresponse()
+        reply = (response.status, json.loads(response.read().decode('utf-8')))
+        connection.close()
+        return reply
+
+    try:
+        assert request('POST', {'file': 5})[0] == 400
+        assert request('POST', {'file': ['talk.json']})[0] == 400
+        assert request('POST', {'file': str(tmp_path / 'missing.json')})[0] == 404
+        status, job = request('POST', {'file': str(json_whisper)})
+        assert (status, job['status']) == (202, 'queued')
+        service.update(service.jobs[job['id']], status = 'running', seconds = 1.5)
+        status, jobs = request('GET')
+        assert (status, jobs[0]['status'], jobs[0]['seconds']) == (200, 'running', 1.5)
+    finally:
+        server.shutdown()
+        server.server_close()
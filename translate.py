@@ -1,10 +1,34 @@
 import json
+import sys
 import datetime
 import copy
 import os
 import shutil
 import re
 import argparse
+import contextlib
+import cProfile
+import pstats
+import io
+import hashlib
+import math
+import sqlite3
+import threading
+import time
+import glob
+import queue
+import signal
+import http.server
+import random
+import email.utils
+import functools
+import unicodedata
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed
+try:
+    import numpy as np  # pip install numpy, for the --timeline stage and the bulk time formatting only
+except ImportError:
+    np = None
 
 # https://py-googletrans.readthedocs.io/en/latest/
 # https://pypi.org/project/googletrans/
@@ -15,7 +39,7 @@ import argparse
 # !pip install googletrans==3.1.0a0
 # if you see invalid command 'bdist_wheel', please 'pip install wheel'
 
-from googletrans import Translator
+# googletrans is imported by GoogleTransBackend only, so the stub backend works without it
 # https://github.com/ssut/py-googletrans/issues/280
 # For anyone receives NoneType' object has no attribute 'group, if you are currently using googletrans==3.0.0, 
 # please switch to googletrans==3.1.0a0 for the temporary fix.
@@ -37,8 +61,56 @@ def parse_args():
     # parser.add_argument("-l", "--url", action="store_true", help="parse from conf_test/urls.txt")
 
     parser.add_argument("-s", "--source", type=str, help="specify the json file name") 
+    parser.add_argument("-w", "--workers", type=int, default=1, help="how many chunks to translate at the same time")
+    parser.add_argument("-r", "--rate", type=float, default=None, help="max translation requests per second for all workers")
+    parser.add_argument("--cache", type=str, default=os.path.join('translated', 'translation_cache.sqlite'), help="the sqlite translation cache file")
+    parser.add_argument("--cache-size", type=int, default=200, help="max size of the translation cache in MB, least recently used translations are evicted")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the translation cache")
+    parser.add_argument("-b", "--backend", type=str, default='google', choices=['google', 'stub'], help="the translator backend, stub translates offline")
+    parser.add_argument("--proxy", type=str, default='http://127.0.0.1:10809', help="proxy for the google backend, empty string for no proxy")
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds before a translation request times out")
+    parser.add_argument("--retries", type=int, default=5, help="times a failed translation request is retried with exponential backoff, 0 for no retry")
+    parser.add_argument("--backoff", type=float, default=1.0, help="seconds to wait before the first retry, doubled for each next one")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="seconds the stub backend sleeps for every request")
+    parser.add_argument("--chars-limit", type=int, default=10000, help="max chars of a chunk, the unit of the checkpoints and the alignment")
+    parser.add_argument("--chunk-sizes", type=str, default=os.path.join('translated', 'chunk_sizes.json'), help="the request sizes learned for each backend, empty string for not adaptive")
+    parser.add_argument("--latency-budget", type=float, default=10.0, help="seconds a translation request should take at most, larger requests are split")
+    parser.add_argument("--src", type=str, default='en', help="the language of the whisper transcript")
+    parser.add_argument("--dest", type=lambda dests: dests.split(','), default=['zh-cn'], help="target languages, comma separated, such as zh-cn,ja,es; "
+                        "other than the default zh-cn, each is written into translated/<lang>/<name>.<lang>.srt")
+    parser.add_argument("--glossary", type=str, default=None, help="terms not to translate, one a line, or term<tab>translation to force the translation")
+    parser.add_argument("--align", type=str, default='dp', choices=['dp', 'greedy'], help="how the translated sentences are matched to the cues")
+    parser.add_argument("--timeline", action="store_true", help="fix the times of the translated subtitles for reading: overlaps, gaps, too short or too long cues, needs numpy")
+    parser.add_argument("--min-duration", type=int, default=1000, help="with --timeline, min milliseconds of a cue")
+    parser.add_argument("--max-duration", type=int, default=7000, help="with --timeline, max milliseconds of a cue, longer ones are split")
+    parser.add_argument("--max-cps", type=float, default=20.0, help="with --timeline, max English chars per second")
+    parser.add_argument("--max-cps-target", type=float, default=11.0, help="with --timeline, max translated chars per second")
+    parser.add_argument("--gap", type=int, default=100, help="with --timeline, gaps between cues shorter than these milliseconds are closed")
+    parser.add_argument("--stream", action="store_true", help="read the whisper segments one by one, dropping tokens and the other per segment fields")
+    parser.add_argument("-f", "--formats", type=lambda formats: formats.split(','), default=['srt'], help="subtitle formats to write, comma separated: srt,vtt,ass,jsonl")
+    parser.add_argument("--profile", action="store_true", help="write the stage timings, counters and latency histograms to profile.json in the output directory")
+    parser.add_argument("--cprofile", action="store_true", help="with --profile, also run the cpu bound stages under cProfile")
+    parser.add_argument("--fresh", action="store_true", help="ignore manifest.json and the chunk checkpoints, rebuild all the stages")
+    parser.add_argument("--batch", type=str, default=None, help="a directory or glob of whisper json files, each is written into translated/<name>/")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="processes for the batch mode")
+    parser.add_argument("--watch", type=str, default=None, help="keep running and translate the whisper json files added to or changed in this directory")
+    parser.add_argument("--serve", type=int, default=None, help="keep running and take jobs by http on this local port: POST /jobs {\"file\": path}, GET /jobs[/<id>]")
+    parser.add_argument("--poll", type=float, default=2.0, help="seconds between the scans of the --watch directory")
+    parser.add_argument("--live", type=str, default=None, help="translate whisper segments as they come, one json per line, from this growing file or - for stdin")
+    parser.add_argument("--live-latency", type=float, default=3.0, help="max seconds a live segment waits for its sentence to end before it is translated")
+    parser.add_argument("--live-deadline", type=float, default=10.0, help="seconds a live chunk waits for its translation before its cues are written untranslated")
+    parser.add_argument("--queue-size", type=int, default=16, help="max jobs waiting in the service mode, more are refused until there is room")
 
     args = parser.parse_args()  
+    for fmt in args.formats:
+        if not fmt in subtitle_headers:
+            parser.error('unknown subtitle format: %s' % fmt)
+    if len(args.dest) > 1 and (args.batch is not None or args.watch is not None or args.serve is not None or args.live is not None):
+        parser.error('several --dest languages are supported for a single --source only')
+    if args.timeline and np is None:
+        parser.error('--timeline needs numpy: pip install numpy')
+    if args.timeline and args.live is not None:
+        parser.error('--timeline is not supported with --live, the cues are written before the next ones are known')
     return args
 
 
@@ -48,6 +120,8 @@ class ComplexEncoder(json.JSONEncoder):
             return obj.strftime('%Y-%m-%d %H:%M:%S')
         elif isinstance(obj, datetime.date):
             return obj.strftime('%Y-%m-%d')
+        elif isinstance(obj, Cue):
+            return obj.to_dict()
         else:
             return json.JSONEncoder.default(self, obj)
 
@@ -55,6 +129,78 @@ def dump_json(_file, _dict, sort_keys = False):
     with open(_file, 'w') as fp:
         json.dump(_dict, fp, cls = ComplexEncoder, indent=4, sort_keys=sort_keys)
 
+def dump_json_atomic(_file, _dict):
+    """
+        dump to a temporary file then rename, so an interrupted run never leaves a broken json behind
+    """
+    tmp_file = '%s.tmp' % _file
+    dump_json(_file = tmp_file, _dict = _dict)
+    os.replace(tmp_file, _file)
+
+def hash_file(_file):
+    """
+        Return: str, sha256 hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(_file, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_json(_dict):
+    """
+        Return: str, sha256 hex digest of the json dump of _dict
+    """
+    raw = json.dumps(_dict, cls = ComplexEncoder, sort_keys = True, ensure_ascii = False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class Manifest(object):
+    """
+        the hash of the inputs of each stage, saved as manifest.json in the output directory.
+        A stage is rebuilt only if its input hash changed or one of its outputs is missing.
+        Args:
+            path: str, path to manifest.json
+    """
+    def __init__(self, path):
+        self.path = path
+        self.stages = {}
+        if os.path.exists(path):
+            with open(path, 'r') as fp:
+                self.stages = json.load(fp)
+
+    def fresh(self, stage, key, outputs):
+        """
+            Args:
+                stage: str, such as 'standardize', 'transform', 'translate', 'combine', 'srt'
+                key: str, the hash of the stage inputs
+                outputs: list of str, the files written by the stage
+            Return: boolean, True if the stage can be skipped
+        """
+        info = self.stages.get(stage)
+        if info is None or info['key'] != key:
+            return False
+        return all(os.path.exists(output) for output in outputs)
+
+    def update(self, stage, key):
+        self.stages[stage] = {
+            'key': key,
+            'time': datetime.datetime.now()
+        }
+        dump_json_atomic(_file = self.path, _dict = self.stages)
+
+
+def code_hash():
+    """
+        the hash of this script, part of the keys of the local stages, so fixing the code rebuilds them
+    """
+    global _code_hash
+    if _code_hash is None:
+        _code_hash = hash_file(os.path.abspath(__file__))
+    return _code_hash
+
+_code_hash = None
+
 def transform_time_srt_hour(dot_time):
     """
         "04:36.4" to "00:04:36,400"
@@ -108,122 +254,349 @@ def combine(json_transcripts, json_pairs):
     if os.path.exists(json_pairs):  # if not translate_list, the paris file does not exists
         with open(json_pairs, 'r') as fp:
             pairs = json.load(fp)
+    return combine_lists(transcripts = transcripts, pairs = pairs)
+
+
+def combine_lists(transcripts, pairs):
+    """
+        combine the loaded transcripts with the pairs, see combine
+        Args:
+            transcripts: list of Cue or dict, as returned by standardize_whisper
+            pairs: list of dict, as returned by translate
+        Return: (list of Cue, boolean)
+            the boolean indicates the pairs is empty
+    """
     index = 0
     combines = []
     empty_pairs = (len(pairs) == 0)
     for transcript in transcripts:
-        info = copy.deepcopy(transcript)
-        origin = transcript['text']
+        info = Cue.from_dict(transcript)  # the target is added to the same cue, nothing is copied
+        origin = info.text
         if not empty_pairs:
             if origin == pairs[index]['origin']:
-                info['target'] = pairs[index]['target']
+                info.target = pairs[index]['target']
             else:
                 print('%d: target not found. origin =%s' %(index, origin))
             index += 1
         combines.append(info)
     return combines, empty_pairs
 
-def select_opt_break(_list):
+@functools.lru_cache(maxsize = None)
+def char_width(char):
     """
-        choose the optimal index by which the list is splited into two lists, the difference of the sum of the two lists is minimal
-        for example, [20,15,6,30] returns 1, then the list is splited into [20,15] and [6,30]
-        Args:
-            _list: list of int
-        Return: int, the opt index in the list
+        the display width of a char: 2 for the East Asian wide and full-width ones, 0 for the combining marks, 1 for the others
     """
-    if not type(_list) is list:
-        raise ValueError('select_opt_break: incoming should be list')
-    for m in _list:
-        if not type(m) is int:
-            raise ValueError('select_opt_break: memebers in list should be int')
-        else:
-            if m < 0:
-                raise ValueError('select_opt_break: memeber should be non-negative int')
-    if len(_list) == 0:
-        raise ValueError('select_opt_break: list can not be empty')
-    if len(_list) <= 2:
+    if unicodedata.combining(char):
         return 0
-    i = -1
-    sum = 0
-    total = 0
-    for number in _list:
-        total += number
-    diff = total
-    for number in _list:
-        i += 1  # current index
-        sum = sum + number
-        sum_left = total - sum
-        new_diff = sum_left - sum
-        new_diff = new_diff if new_diff > 0 else (-new_diff)
-        if new_diff < diff:  # this will not happen for i == 0
-            diff = new_diff
-        else:
-            i -= 1  # previous index
-            break
-    return i
+    return 2 if unicodedata.east_asian_width(char) in ('W', 'F') else 1
+
+
+def display_width(text):
+    return sum(char_width(char) for char in text)
+
+
+_sentence_ends = '。！？…'
+_clause_ends = '，、；：'
+_no_line_start = '，。、！？；：…）」』”’》%'  # closing punctuation stays on the line before
+_no_line_end = '（「『“‘《'
+
+
+def break_candidates(text):
+    """
+        where a line may end, by class: after 。！？ (penalty 0), after ，、；： (10), at spaces (50),
+        and between the chars of CJK text (400); never inside a run of digits or Latin letters, so 35,000 and H100 stay whole
+        Return: list of (int, int, int), the end of the line, the start of the next line and the penalty
+    """
+    candidates = []
+    n = len(text)
+    k = 1
+    while k < n:
+        a = text[k - 1]
+        b = text[k]
+        if b == ' ':
+            start = k
+            while start < n and text[start] == ' ':
+                start += 1
+            if a != ' ' and start < n:
+                candidates.append((k, start, 50))
+            k = start + 1
+            continue
+        if b in _no_line_start or a in _no_line_end or a == ' ':
+            pass
+        elif a in _sentence_ends:
+            candidates.append((k, k, 0))
+        elif a in _clause_ends:
+            candidates.append((k, k, 10))
+        elif char_width(a) == 2 or char_width(b) == 2:
+            candidates.append((k, k, 400))
+        k += 1
+    return candidates
+
+
+@functools.lru_cache(maxsize = 65536)
+def break_lines(text, max_width = 50, max_lines = 2):
+    """
+        break text into lines no wider than max_width (see display_width), optimally by dynamic programming:
+        the cost of a layout is the sum over the lines of the squared room left plus the penalty of each break (see break_candidates),
+        plus max_width ** 2 for each line, so fewer lines come first and then balanced lines.
+        If the text does not fit in max_lines lines, the width is raised until it does, as the text has to be shown anyway.
+        A line looks back at most max_width columns, so the time is linear in the length of text; the results are memoized.
+        Args:
+            text: str
+            max_width: int, columns, a CJK char takes 2
+            max_lines: int
+        Return: str, the lines joined by \n
+    """
+    if '\n' in text:  # the lines already there, such as the sentences of a cue, are broken on their own
+        return '\r\n'.join(break_lines(line, max_width = max_width, max_lines = max_lines) for line in text.replace('\r\n', '\n').split('\n'))
+    widths = [0]
+    for char in text:
+        widths.append(widths[-1] + char_width(char))
+    total = widths[-1]
+    if total <= max_width:
+        return text
+    width = max(max_width, -(-total // max_lines))
+    breaks = break_candidates(text)
+    if max_lines == 2:  # the usual case: the best single break that fits, the same as the dynamic programming finds
+        best = None
+        for end, start, penalty in breaks:
+            room1 = width - widths[end]
+            room2 = width - (total - widths[start])
+            if room1 >= 0 and room2 >= 0:
+                cost = room1 * room1 + room2 * room2 + penalty
+                if best is None or cost <= best[0]:  # the later of equal breaks, as the dynamic programming
+                    best = (cost, end, start)
+        if best is not None:
+            return '%s\n%s' %(text[:best[1]], text[best[2]:])
+    return layout_lines(text, widths, breaks, width, max_lines)
+
+
+def layout_lines(text, widths, breaks, width, max_lines):
+    """
+        the dynamic programming of break_lines, see it for the cost
+        Args:
+            widths: list of int, the display width of text[:i] for each i
+            breaks: list, returned by break_candidates
+            width: int, the width of a line
+            max_lines: int
+        Return: str, the lines joined by \n
+    """
+    candidates = [(0, 0, 0)] + breaks + [(len(text), len(text), 0)]
+    line_cost = width * width
+    costs = [0.0] + [None] * (len(candidates) - 1)
+    backs = [0] * len(candidates)
+    lines = [0] * len(candidates)
+    for j in range(1, len(candidates)):
+        end, _, penalty = candidates[j]
+        i = j - 1
+        while i >= 0:
+            start = candidates[i][1]
+            line_width = widths[end] - widths[start]
+            if costs[i] is not None:
+                room = width - line_width
+                cost = costs[i] + line_cost + penalty + (room * room if room >= 0 else 100 * room * room + 10 * line_cost)
+                if lines[i] >= max_lines:
+                    cost += 10 * line_cost
+                if costs[j] is None or cost < costs[j]:
+                    costs[j] = cost
+                    backs[j] = i
+                    lines[j] = lines[i] + 1
+            if line_width > width and j - i > 1:  # wider than a line: looking further back only makes it wider
+                break
+            i -= 1
+    result = []
+    j = len(candidates) - 1
+    while j > 0:
+        i = backs[j]
+        result.append(text[candidates[i][1]:candidates[j][0]])
+        j = i
+    result.reverse()
+    return '\n'.join(result)
 
 
 def break_line(text, chars_limit = 25):
     """
-        break text into two lines, bounded to max of chars_limit and a half of the length of text, but comman, prefered first.
-        re not perfect yet
+        break text into two lines, see break_lines
         Args: 
             text: str
-            chars_limit: int, the max allowed is 70
+            chars_limit: int, the max CJK chars of a line, i.e. 2 * chars_limit columns
         Return: str, seperated text by \n
     """
-    # be careful of digit 35,000
-    len_text = len(text)
+    return break_lines(text, max_width = chars_limit * 2, max_lines = 2)
 
-    if len_text <= chars_limit:  # not to break
-        return text
-    # print(len(text))
-    digits = re.findall(r'\d+[,\d{3}]+', text)  # find the digit seperated by , not perfect
-    # 非常高兴能够全面量产 H100，我要感谢你们所有人的支持 still matches 100
-    new_text = text
-    for digit in digits:
-        new_digit = digit.replace(',', '')
-        new_text = new_text.replace(digit, new_digit)  # remove , for digit
-
-    # if you can find a re.split to replace the only non-digit , then you do not need to replace digit
-    groups = new_text.split('，')  # ，the Chinese ,
-    
-    text1 = ''
-    text2 = ''
-    num = len(groups)
-    if num < 2:
-        return text
-    lens = [len(group) for group in groups]
-    index = select_opt_break(lens)
-    i = 0
-    for group in groups:
-        i += 1
-        if i - 1 <= index:
-            text1 += group
-            text1 = text1 + '，' if i < num else text1
-        else:
-            text2 += group
-            text2 = text2 + '，' if i < num else text2
+
+ass_header = """[Script Info]
+ScriptType: v4.00+
+PlayResX: 1920
+PlayResY: 1080
+WrapStyle: 0
+
+[V4+ Styles]
+Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, MarginR, MarginV, Encoding
+Style: Default,Arial,54,&H00FFFFFF,&H000000FF,&H00000000,&H64000000,0,0,0,0,100,100,0,0,1,2,1,2,20,20,40,1
+
+[Events]
+Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text
+"""
+
+subtitle_headers = {
+    'srt': '',
+    'vtt': 'WEBVTT\n\n',
+    'ass': ass_header,
+    'jsonl': ''
+}
+
+
+def format_times(fmt, start_ms, end_ms):
     """
-    # max_chars = max(chars_limit, len_text / 2)
-    max_chars = len_text / 2  # that is the chars limit for a single line for the first line    
-    i = 0
-    sum = 0
-    for group in groups:
-        i += 1
-        sum = sum + len(group) + 1  # count the length of text
-        if sum < max_chars:
-            text1 += group
-            text1 = text1 + '，' if i < num else text1
+        the time line of a cue in the format
+        Return: str for srt and vtt, (str, str) for ass, (int, int) for jsonl
+    """
+    if fmt == 'srt':
+        return '%s --> %s' %(ms_to_srt(start_ms), ms_to_srt(end_ms))
+    if fmt == 'vtt':
+        return '%s --> %s' %(ms_to_srt(start_ms).replace(',', '.'), ms_to_srt(end_ms).replace(',', '.'))
+    if fmt == 'ass':
+        return (ms_to_ass(start_ms), ms_to_ass(end_ms))
+    return (start_ms, end_ms)
+
+
+def bulk_times(fmt, starts, ends):
+    """
+        format_times for all the cues at once, the hours, minutes, seconds and milliseconds are computed on numpy arrays
+        Args:
+            starts, ends: list of int, milliseconds
+        Return: list, see format_times
+    """
+    if np is None or fmt == 'jsonl':
+        return [format_times(fmt, start_ms, end_ms) for start_ms, end_ms in zip(starts, ends)]
+    fields = []
+    for ms in (np.asarray(starts, dtype = np.int64), np.asarray(ends, dtype = np.int64)):
+        if fmt == 'ass':
+            fields.append(zip(*(part.tolist() for part in (ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms // 10 % 100))))
         else:
-            if i == 1: # the first group which has been greater than the limit
-                text1 = group + '，' if num > 1 else group
-            else:
-                text2 += group
-                text2 = text2 + '，' if i < num else text2
+            fields.append(zip(*(part.tolist() for part in (ms // 3600000, ms // 60000 % 60, ms // 1000 % 60, ms % 1000))))
+    if fmt == 'ass':
+        return [('%d:%02d:%02d.%02d' % start, '%d:%02d:%02d.%02d' % end) for start, end in zip(*fields)]
+    line = '%02d:%02d:%02d,%03d --> %02d:%02d:%02d,%03d' if fmt == 'srt' else '%02d:%02d:%02d.%03d --> %02d:%02d:%02d.%03d'
+    return [line % (start + end) for start, end in zip(*fields)]
+
+
+def format_cue(fmt, order_int, times, subtitle, subtitle2 = None, keys = ('text', 'text_second')):
+    """
+        one cue in the format, times is returned by format_times
+        Return: str
+    """
+    if fmt == 'srt':
+        if subtitle2 is None:
+            return '%s\r\n%s\r\n%s\r\n\r\n' %(str(order_int), times, subtitle)
+        return '%s\r\n%s\r\n%s\r\n%s\r\n\r\n' %(str(order_int), times, subtitle, subtitle2)
+    lines = subtitle.replace('\r\n', '\n')
+    if not subtitle2 is None:
+        lines = '%s\n%s' %(lines, subtitle2.replace('\r\n', '\n'))
+    if fmt == 'vtt':
+        return '%s\n%s\n%s\n\n' %(str(order_int), times, lines)
+    if fmt == 'ass':
+        return 'Dialogue: 0,%s,%s,Default,,0,0,0,,%s\n' %(times[0], times[1], lines.replace('\n', '\\N'))
+    info = {
+        'order': order_int,
+        'start_ms': times[0],
+        'end_ms': times[1],
+        keys[0]: subtitle
+    }
+    if not subtitle2 is None:
+        info[keys[1]] = subtitle2
+    return json.dumps(info, ensure_ascii = False) + '\n'
+
+
+def expand_formats(outputs, formats):
+    """
+        one output for each format, the extension of file_name is replaced by the format
+        Args:
+            outputs: list of dict, see write_subtitles
+            formats: list of str, such as ['srt', 'vtt']
+        Return: list of dict
+    """
+    expanded = []
+    for output in outputs:
+        for fmt in formats:
+            new_output = dict(output)
+            new_output['file_name'] = '%s.%s' %(os.path.splitext(output['file_name'])[0], fmt)
+            new_output['format'] = fmt
+            expanded.append(new_output)
+    return expanded
+
+
+def write_subtitles(_dict, outputs, order = 'order', start = 'in', end = 'out', flush = False, max_width = 50, max_lines = 2):
+    """
+        write several subtitle files in one pass over the transcripts, each file is opened once and written through a buffer
+        Args:
+            _dict: list or iterable of Cue or dict
+            outputs: list of dict, one for each file
+                [{
+                    'file_name': str,
+                    'format': str, default 'srt', one of 'srt', 'vtt', 'ass', 'jsonl'
+                    'text': str, the key to read the text
+                    'text_second': str, default None, usually the key to read cn text
+                    'break_sub': boolean, default False, see write_srt2
+                },...]
+            order: str, the key to read the order for srt
+            start: str, the key to read the start time
+            end: str, the key to read the end time
+            flush: boolean, default False, flush the files after each cue, for readers following them while _dict is produced
+            max_width, max_lines: the size of a broken subtitle, see break_lines
     """
-    result = text1 if text2 == '' else '%s\n%s' %(text1, text2)
-    return result
+    writers = []
+    written = 0
+    all_times = {}  # format -> the time lines of all the cues, when _dict is a list of Cue
+    if isinstance(_dict, list) and start == 'in' and end == 'out' and all(isinstance(transcript, Cue) for transcript in _dict):
+        starts = [transcript.start_ms for transcript in _dict]
+        ends = [transcript.end_ms for transcript in _dict]
+        for output in outputs:
+            fmt = output.get('format', 'srt')
+            if not fmt in all_times:
+                all_times[fmt] = bulk_times(fmt, starts, ends)
+    try:
+        for output in outputs:
+            writer = open(output['file_name'], 'w', encoding='utf-8', buffering=1024*1024)
+            writers.append(writer)
+            writer.write(subtitle_headers[output.get('format', 'srt')])
+        for i, transcript in enumerate(_dict):
+            order_int = transcript[order]
+            if isinstance(transcript, Cue) and start == 'in' and end == 'out':
+                start_ms, end_ms = transcript.start_ms, transcript.end_ms
+            else:
+                start_ms, end_ms = srt_to_ms(transcript[start]), srt_to_ms(transcript[end])
+            times = {}  # the time line of each format is shared by all the files
+            broken = {}  # the same text is broken into lines only once for all the files
+            for output, writer in zip(outputs, writers):
+                fmt = output.get('format', 'srt')
+                if not fmt in times:
+                    times[fmt] = all_times[fmt][i] if fmt in all_times else format_times(fmt, start_ms, end_ms)
+                text = output['text']
+                text_second = output.get('text_second')
+                subtitle = transcript[text].strip(' ')
+                if output.get('break_sub', False) and fmt != 'jsonl':
+                    if not text in broken:
+                        broken[text] = break_lines(subtitle, max_width = max_width, max_lines = max_lines)  # break the first subtitle into multiple lines
+                    subtitle = broken[text]
+                subtitle2 = None
+                if not text_second is None:
+                    if fmt == 'jsonl':
+                        subtitle2 = transcript[text_second].strip(' ')
+                    else:
+                        if not text_second in broken:
+                            broken[text_second] = break_lines(transcript[text_second].strip(' '), max_width = max_width, max_lines = max_lines)
+                        subtitle2 = broken[text_second]
+                writer.write(format_cue(fmt, order_int, times[fmt], subtitle, subtitle2, keys = (text, text_second)))
+                written += 1
+            if flush:
+                for writer in writers:
+                    writer.flush()
+    finally:
+        for writer in writers:
+            writer.close()
+        profiler.count('cues_written', written)
 
 
 def write_srt2(file_name, _dict, order = 'order', start = 'in', end = 'out', text = 'text', text_second = None, break_sub = False):
@@ -239,27 +612,13 @@ def write_srt2(file_name, _dict, order = 'order', start = 'in', end = 'out', tex
             break_sub: boolean, by default, the first subtitle will not be broken into multiple lines, the second subtitle will be broken into multiple lines.
                 To also break the first subtitle into multiple lines, set this as True. (If the second subtitle is None, that means break the only subtitle into multiple lines)
     """
-    with open(file_name, 'w', encoding='utf-8') as writer:
-        pass  
-    for transcript in _dict:
-        order_int = transcript[order]
-        in_time = transcript[start]
-        out_time = transcript[end]
-        subtitle = transcript[text].strip(' ')
-        start_time = transform_time_srt_hour(in_time)
-        end_time = transform_time_srt_hour(out_time)
-        time_line = '%s --> %s' %(start_time, end_time)
-        with open(file_name, 'a', encoding='utf-8') as writer:
-            if break_sub:
-                subtitle = subtitle.strip(' ')
-                subtitle = break_line(subtitle, chars_limit=25)  # break the first subtitle into multiple lines
-            if text_second is None:
-                script = '%s\r\n%s\r\n%s\r\n\r\n' %(str(order_int), time_line, subtitle)
-            else:
-                subtitle2 = transcript[text_second].strip(' ')
-                subtitle2 = break_line(subtitle2, chars_limit=25)
-                script = '%s\r\n%s\r\n%s\r\n%s\r\n\r\n' %(str(order_int), time_line, subtitle, subtitle2)
-            writer.write(script)
+    output = {
+        'file_name': file_name,
+        'text': text,
+        'text_second': text_second,
+        'break_sub': break_sub
+    }
+    write_subtitles(_dict = _dict, outputs = [output], order = order, start = start, end = end)
 
 
 def judge_sentence(text):
@@ -282,55 +641,432 @@ def judge_sentence_en(text):
         return int
     """
     c = 0
-    new_text = text.replace('Mr.', 'Mr').replace('U.S.', 'US').replace('US.', 'US').replace('Dr.', 'Dr').replace('A.I.', 'AI')
-    for char in new_text:
-        if char in ('?', '.'):  # should exclude 88.6%
+    for m in _en_marks.finditer(text):
+        if m.lastgroup == 'mark':  # should exclude 88.6%
             c += 1
-    digits_dot = len(re.findall(re.compile(r'[\d]+\.[\d]+'), new_text))  # count the digits with dot
-    c -= digits_dot  # should also exclude domain name
-    c = max(c, 0)
+    # should also exclude domain name
     return c
 
+_en_marks = re.compile(r'(?P<skip>Mr\.|U\.S\.|US\.|Dr\.|A\.I\.|\d+\.\d+)|(?P<mark>[?.])')
+
+
+class TermMatcher(object):
+    """
+        Aho-Corasick automaton over a list of terms: all the occurrences of all the terms are found in one scan of the text,
+        so the time does not grow with the number of terms.
+        Args:
+            terms: list of str
+            whole_word: boolean, default False, only the occurrences not preceded or followed by a word char
+    """
+    def __init__(self, terms, whole_word = False):
+        self.terms = list(terms)
+        self.whole_word = whole_word
+        self.goto = [{}]  # state -> {char: state}
+        self.fail = [0]
+        self.outputs = [[]]  # state -> list of term indexes ending there, the longest first
+        for index, term in enumerate(self.terms):
+            if not term:
+                continue
+            state = 0
+            for char in term:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append(index)
+        # breadth first, the fail link of a state is the longest proper suffix of its path that is also a state
+        states = list(self.goto[0].values())
+        for state in states:
+            for char, next_state in self.goto[state].items():
+                states.append(next_state)
+                fail = self.fail[state]
+                while fail and not char in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[self.fail[next_state]]
+
+    def finditer(self, text):
+        """
+            Return: generator of (int, int, int), start, end and term index of every occurrence, overlapping ones included,
+                in the order of their ends
+        """
+        goto = self.goto
+        fail = self.fail
+        outputs = self.outputs
+        state = 0
+        for i, char in enumerate(text):
+            while state and not char in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in outputs[state]:
+                start = i + 1 - len(self.terms[index])
+                if self.whole_word and ((start > 0 and (text[start - 1].isalnum() or text[start - 1] == '_'))
+                                        or (i + 1 < len(text) and (text[i + 1].isalnum() or text[i + 1] == '_'))):
+                    continue
+                yield start, i + 1, index
+
+    def find(self, text):
+        """
+            Return: list of (int, int, int), the leftmost longest occurrences not overlapping each other
+        """
+        matches = sorted(self.finditer(text), key = lambda match: (match[0], -match[1]))
+        found = []
+        end = 0
+        for match in matches:
+            if match[0] >= end:
+                found.append(match)
+                end = match[1]
+        return found
+
+
+class SentenceSegmenter(object):
+    """
+        find the ends of English sentences in one scan.
+        The dot of the abbreviations, middle names such as "Howard K. Smith" and decimals is not an end;
+        "...", "?", "!", dot followed by space and dot at the end of the text are.
+        The abbreviations are found by a TermMatcher, so the list can be long.
+        Args:
+            abbreviations: list of str, default SentenceSegmenter.abbreviations
+    """
+    abbreviations = ('Mr.', 'U.S.', 'US.', 'Dr.', 'A.I.', 'St.')
+    ends = re.compile(r'\.\.\.|[?!]|\.(?: +|$)')
+    initial = re.compile(r' [A-Z]\. (?=[A-Z][a-z])')  # the English midle name: Howard K. Smith, also Dr. K. Smith
+    named_initial = re.compile(r'[A-Z][a-z]+ [A-Z]\. (?=[A-Z][a-z])')
+
+    def __init__(self, abbreviations = None):
+        if abbreviations is None:
+            abbreviations = self.abbreviations
+        self.matcher = TermMatcher(abbreviations)
+        self.titles = set(
+            index
+            for index, abbreviation in enumerate(self.matcher.terms)
+            if re.match(r'^[A-Z][a-z]+\.$', abbreviation)
+        )
+
+    def covered(self, text):
+        """
+            Return: dict, offset -> the end of the abbreviation or middle name covering it, for the offsets not to be taken as ends
+        """
+        cover = {}
+        spans = [(m.start(), m.end()) for m in self.named_initial.finditer(text)]
+        for start, end, index in self.matcher.finditer(text):
+            if index in self.titles:
+                m = self.initial.match(text, end)
+                if m is not None:
+                    end = m.end()
+            spans.append((start, end))
+        for start, end in spans:
+            for offset in range(start, end):
+                if cover.get(offset, 0) < end:
+                    cover[offset] = end
+        return cover
+
+    def boundaries(self, text):
+        """
+            Return: list of int, the offsets right after the punctuation ending each sentence
+        """
+        offsets = []
+        m = self.ends.search(text)
+        if m is None:
+            return offsets
+        cover = self.covered(text) if '.' in text else {}
+        while m is not None:
+            if m.start() in cover:  # the end is in an abbreviation, go on after it
+                m = self.ends.search(text, cover[m.start()])
+                continue
+            offsets.append(m.start() + (3 if m.group() == '...' else 1))
+            m = self.ends.search(text, m.end())
+        return offsets
+
+    def count(self, text):
+        """
+            Return: int, the number of sentence ends, see judge_sentence_en_2
+        """
+        return len(self.boundaries(text))
+
+    def count_many(self, texts):
+        """
+            Return: list of int, count for each of texts
+        """
+        return [self.count(text) for text in texts]
+
+    def split(self, text):
+        """
+            Return: list of (int, int), the spans of the sentences, the text after the last end is the last span if not blank
+        """
+        spans = []
+        start = 0
+        for offset in self.boundaries(text):
+            spans.append((start, offset))
+            start = offset
+        if text[start:].strip() != '':
+            spans.append((start, len(text)))
+        return spans
+
+
 def judge_sentence_en_2(text):
     """
         Args:
             text: str, should be English str and punctation
-        count how many specified chars appear in the text
+        count how many specified chars appear in the text, see SentenceSegmenter
         return int
     """
-    c = 0
-    new_text = text.replace('Mr.', 'Mr').replace('U.S.', 'US').replace('US.', 'US').replace('Dr.', 'Dr').replace('A.I.', 'AI').replace('St.', 'St')
-    for char in new_text:
-        if char in ('?'):  # 
-            c += 1
-    ignore = len(re.findall(re.compile(r'\.\.\.'), new_text))  # count the ...
-    new_text = re.sub(re.compile(r'\.\.\.'), '', new_text)  # to avoid duplicated counting dot at the end of a line, or dot followed by space
-    space_dot = len(re.findall(re.compile(r'\. +'), new_text))  # count the dot followed by space
-    # "Howard K. Smith"  if you count the pattern "space after dot" as an end of sentence, you have to exclude many midle name followed by dot
-    en_name = len(re.findall(re.compile(r'[A-Z][a-z]+ [A-Z]\. [A-Z][a-z]+'), new_text))  # count the English midle name, for example: Howard K. Smith, 
-    # start with one Upper case letter, then lower case letters and space, then one Uper case letter, then dot and space, Upper case letter, lowercase letters
-    return_dot = len(re.findall(re.compile(r'\.$'), new_text))    # count the dot at then end of a line
-    sup = len(re.findall(re.compile(r'!'), new_text))    # count the !
-    
-    c += space_dot + return_dot + sup + ignore - en_name
-    return c
+    return segmenter.count(text)
 
+segmenter = SentenceSegmenter()
 
-def seconds_to_srt(seconds):
+
+def seconds_to_ms(seconds):
     """
         Args:
             seconds: float
-        Return: str
+        Return: int, milliseconds, truncated as in seconds_to_srt
     """
     sec = int(seconds)
-    ms = int((seconds - sec) * 1000)
-    m, s = divmod(sec, 60)
+    return sec * 1000 + int((seconds - sec) * 1000)
+
+
+def ms_to_srt(ms):
+    """
+        Args:
+            ms: int, milliseconds
+        Return: str, such as 00:04:36,400, hours may go beyond 24
+    """
+    s, ms = divmod(ms, 1000)
+    m, s = divmod(s, 60)
     h, m = divmod(m, 60)
-    d, h = divmod(h, 24)
-    pattern = r'%02d:%02d:%02d,%03d'
-    if d > 0:
-        h += d * 24
-    return pattern % (h, m, s, ms)
+    return '%02d:%02d:%02d,%03d' % (h, m, s, ms)
+
+
+def ms_to_ass(ms):
+    """
+        Args:
+            ms: int, milliseconds
+        Return: str, such as 0:04:36.40, in centiseconds
+    """
+    cs, ms = divmod(ms, 10)
+    s, cs = divmod(cs, 100)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return '%d:%02d:%02d.%02d' % (h, m, s, cs)
+
+
+def srt_to_ms(srt_time):
+    """
+        "00:04:36,400" or "04:36.4" to 276400
+        Return: int
+    """
+    hms, ms = transform_time_srt_hour(srt_time).split(',')
+    h, m, s = hms.split(':')
+    return ((int(h) * 60 + int(m)) * 60 + int(s)) * 1000 + int(ms)
+
+
+def seconds_to_srt(seconds):
+    """
+        Args:
+            seconds: float
+        Return: str
+    """
+    return ms_to_srt(seconds_to_ms(seconds))
+
+
+class Cue(object):
+    """
+        one subtitle line, the times are kept as int milliseconds
+        It is read like the dict it replaces: cue['order'], cue['in'], cue['out'], cue['text'], cue['target'], cue['cn_subtitle'], cue['confidence'],
+        so write_srt2 and dump_json work unchanged. The later stages set target and cn_subtitle on the same object instead of copying it.
+    """
+    __slots__ = ('order', 'start_ms', 'end_ms', 'text', 'target', 'cn_subtitle', 'confidence')
+    optional = ('target', 'cn_subtitle', 'confidence')  # only dumped when set
+
+    def __init__(self, order, start_ms, end_ms, text):
+        self.order = order
+        self.start_ms = start_ms
+        self.end_ms = end_ms
+        self.text = text
+        self.target = None
+        self.cn_subtitle = None
+        self.confidence = None
+
+    @classmethod
+    def from_dict(cls, info):
+        """
+            Args:
+                info: Cue, returned as it is; or dict with the keys order, in, out, text and optional target, cn_subtitle
+            Return: Cue
+        """
+        if isinstance(info, cls):
+            return info
+        cue = cls(order = info['order'], start_ms = srt_to_ms(info['in']), end_ms = srt_to_ms(info['out']), text = info['text'])
+        for key in cls.optional:
+            if key in info:
+                setattr(cue, key, info[key])
+        return cue
+
+    def to_dict(self):
+        info = {
+            'order': self.order,
+            'in': ms_to_srt(self.start_ms),
+            'out': ms_to_srt(self.end_ms),
+            'text': self.text
+        }
+        for key in self.optional:
+            value = getattr(self, key)
+            if not value is None:
+                info[key] = value
+        return info
+
+    def __getitem__(self, key):
+        if key == 'in':
+            return ms_to_srt(self.start_ms)
+        if key == 'out':
+            return ms_to_srt(self.end_ms)
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key == 'in':
+            self.start_ms = srt_to_ms(value)
+        elif key == 'out':
+            self.end_ms = srt_to_ms(value)
+        else:
+            setattr(self, key, value)
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+
+def load_whisper(json_whisper, stream = False):
+    """
+        parse the whisper json once, the returned dict is shared by standardize_whisper_dict and transform_whisper_dict
+        Args:
+            json_whisper: str, path to the whisper json
+            stream: boolean, default False, read the segments with iter_segments, only id, start, end and text are kept
+        Return: dict
+    """
+    if stream:
+        return {'segments': list(iter_segments(json_whisper))}
+    with open(json_whisper, 'r') as fp:
+        return json.load(fp)
+
+
+class JsonStream(object):
+    """
+        read json values one by one from a file without loading the whole file
+        Args:
+            fp: file object opened in text mode
+            chunk_size: int, chars read at a time
+    """
+    whitespace = ' \t\r\n'
+
+    def __init__(self, fp, chunk_size = 1024 * 1024):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def read(self, size):
+        """
+            drop the consumed chars and append size more chars
+            Return: boolean, False at the end of file
+        """
+        if self.eof:
+            return False
+        data = self.fp.read(size)
+        if data == '':
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+            skip whitespace
+            Return: str, the next char, '' at the end of file
+        """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.read(self.chunk_size):
+                return ''
+
+    def expect(self, chars):
+        """
+            consume the next char, which should be one of chars
+            Return: str, the char
+        """
+        char = self.peek()
+        if char == '' or not char in chars:
+            raise ValueError('JsonStream: expect %s at %d, got %r' %(chars, self.pos, char))
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """
+            Return: the next json value
+        """
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:  # a number at the end of the buffer may go on
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read(size)
+            size *= 2  # long values such as the full text are read in fewer rounds
+
+
+def iter_segments(json_whisper, fields = ('id', 'start', 'end', 'text'), chunk_size = 1024 * 1024):
+    """
+        yield the whisper segments one by one, keeping only fields; tokens, avg_logprob, compression_ratio... are dropped
+        as soon as each segment is read, so the memory does not grow with the length of the recording
+        Args:
+            json_whisper: str, path to the whisper json, see standardize_whisper
+            fields: tuple of str, the keys to keep
+            chunk_size: int, chars read at a time
+        Return: generator of dict
+    """
+    with open(json_whisper, 'r') as fp:
+        stream = JsonStream(fp, chunk_size = chunk_size)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            key = stream.decode()
+            stream.expect(':')
+            if key == 'segments':
+                stream.expect('[')
+                if stream.peek() == ']':
+                    stream.expect(']')
+                else:
+                    while True:
+                        segment = stream.decode()
+                        yield {field: segment[field] for field in fields}
+                        if stream.expect(',]') == ']':
+                            break
+            else:
+                stream.decode()  # text, language... are skipped
+            if stream.expect(',}') == '}':
+                break
 
 
 def standardize_whisper(json_whisper):
@@ -362,7 +1098,7 @@ def standardize_whisper(json_whisper):
         }
 
         Return:
-            list
+            list of Cue, read as dict
                 [
                     {
                         'order': int,
@@ -374,21 +1110,26 @@ def standardize_whisper(json_whisper):
                 ]
 
     """
-    with open(json_whisper, 'r') as fp:
-        transcripts = json.load(fp)
+    return standardize_whisper_dict(whisper_dict = load_whisper(json_whisper))
+
 
+def standardize_whisper_dict(whisper_dict):
+    """
+        the same as standardize_whisper, but takes the loaded whisper dict, see load_whisper
+    """
+    transcripts = whisper_dict
     return [
-            {
-                'order': transcript['id'] + 1,
-                'in': seconds_to_srt(seconds = transcript['start']),
-                'out': seconds_to_srt(seconds = transcript['end']),
-                'text': transcript['text']
-            }
+            Cue(
+                order = transcript['id'] + 1,
+                start_ms = seconds_to_ms(seconds = transcript['start']),
+                end_ms = seconds_to_ms(seconds = transcript['end']),
+                text = transcript['text']
+            )
             for transcript in transcripts["segments"]       
         ]
 
 
-def transform_whisper(json_whisper, chars_limit = 5000):
+def transform_whisper(json_whisper, chars_limit = 5000, sentence_break = True):
     """
         Group text by chars_limit, return a list of group info
         json_whisper:
@@ -413,6 +1154,8 @@ def transform_whisper(json_whisper, chars_limit = 5000):
         }
         Args:
             json_colab: str, path, the path to the Google Colab Whisper exported json, parsed into list of dict as example
+            chars_limit: int, the max chars of text_joined in a group, a single longer segment makes its own group
+            sentence_break: boolean, default True, prefer to close a group at the end of a sentence, see transform_whisper_dict
         Return:
             list
                 [{
@@ -423,170 +1166,1192 @@ def transform_whisper(json_whisper, chars_limit = 5000):
                     'text_joined': str
                 },...]
     """
+    return transform_whisper_dict(whisper_dict = load_whisper(json_whisper), chars_limit = chars_limit, sentence_break = sentence_break)
 
-    transcripts = []
-    with open(json_whisper, 'r') as fp:
-        transcripts = json.load(fp)
 
-    # translator = Translator()
-    # chars_limit = 300
+def is_sentence_end(text):
+    """
+        whether the text ends a sentence, judged by judge_sentence_en_2 on the last word only,
+        so "Mr." or "U.S." at the end is not taken as the end of a sentence
+        Return: boolean
+    """
+    words = text.rstrip().rsplit(' ', 1)
+    return judge_sentence_en_2(words[-1]) > 0
+
+
+def make_group(to_trans, chars, end_order):
+    """
+        the group info returned by transform_whisper
+    """
+    return {
+        'chars': chars,
+        'number': len(to_trans),
+        'end_order': end_order,
+        'texts': to_trans,
+        'text_joined': ' '.join(to_trans)
+    }
+
+
+def group_texts(texts, chars_limit = 5000, sentence_break = True):
+    """
+        the grouping of transform_whisper_dict, linear in the total length of texts: only the lengths are added up.
+        Args:
+            texts: iterable of str
+            chars_limit: int, the max chars of ' '.join(group), a single longer text makes its own group
+            sentence_break: boolean, default True, close the group after the last text ending a sentence (see is_sentence_end),
+                if that keeps at least half of chars_limit; otherwise the group is closed at the last text within chars_limit.
+                The texts after the sentence end are carried to the next group.
+        Return: generator of (list of str, int), the group and the length of ' '.join(group)
+    """
+    to_trans = []  # list of str, texts of the current group
+    chars = 0  # length of ' '.join(to_trans)
+    last_end = 0  # the number of texts in to_trans up to the last sentence end, 0 for none
+    end_chars = 0  # the chars up to the last sentence end
+    for text in texts:
+        while len(to_trans) > 0 and chars + 1 + len(text) > chars_limit:  # again for the texts carried over
+            cut = len(to_trans)
+            cut_chars = chars
+            if sentence_break and 0 < last_end < cut and end_chars >= chars_limit / 2:
+                cut = last_end
+                cut_chars = end_chars
+            yield to_trans[:cut], cut_chars
+            to_trans = to_trans[cut:]  # the texts after the sentence end, if any
+            chars = max(chars - cut_chars - 1, 0)
+            last_end = 0
+            end_chars = 0
+        chars += len(text) if len(to_trans) == 0 else len(text) + 1
+        to_trans.append(text)
+        if sentence_break and is_sentence_end(text):
+            last_end = len(to_trans)
+            end_chars = chars
+    if len(to_trans) > 0:
+        yield to_trans, chars
+
+
+def transform_whisper_dict(whisper_dict, chars_limit = 5000, sentence_break = True):
+    """
+        the same as transform_whisper, but takes the loaded whisper dict, see load_whisper
+        Each group is joined once, see group_texts for how the segments are grouped.
+    """
     texts = []  # list of dict
-    to_trans = [] # list of str
-    added = False
-    tmp_text = ''
-    all_text = ''
     end_order = 0
-    if True:
-        for transcript in transcripts["segments"]:         
-            order = transcript['id'] + 1
-            in_time = transcript['start']
-            out_time = transcript['end']
-            text = transcript['text']
-            # print('%d: %s - %s: %s' %(order, in_time, out_time, text))
-            all_text += text
-            current_length = len(tmp_text)
-            tmp_text += text + ' '
-            after_length = len(tmp_text)
-            # print('%d: length = %d' %(order, len(tmp_text)))
-            if after_length > chars_limit:
-                end_order += len(to_trans)
-                info = {
-                    'chars': current_length,
-                    'number': len(to_trans),
-                    'end_order': end_order,
-                    'texts': to_trans,
-                    'text_joined': ' '.join(to_trans)
-                }            
-                texts.append(info)
-                added = True                
-                to_trans = []  # initialized
-                to_trans.append(text)
-                tmp_text = ''
-                tmp_text += text
-            else:
-                added = False
-                to_trans.append(text)
-        # print('len(text) = %d' % len(texts))
-        if not added:
-            end_order += len(to_trans)
-            info = {
-                    'chars': after_length,
-                    'number': len(to_trans),
-                    'end_order': end_order,
-                    'texts': to_trans,
-                    'text_joined': ' '.join(to_trans)
-                }            
-            texts.append(info)
-            # print('len(text) = %d' % len(texts))
+    segment_texts = [transcript['text'] for transcript in whisper_dict["segments"]]
+    all_length = sum(len(text) for text in segment_texts)
+    for to_trans, chars in group_texts(segment_texts, chars_limit = chars_limit, sentence_break = sentence_break):
+        end_order += len(to_trans)
+        texts.append(make_group(to_trans = to_trans, chars = chars, end_order = end_order))
     # check
     texts_len = 0
     for info in texts:
         info_len = info['chars']
         texts_len += info_len
-    print('transform_whisper: original length = %d' % len(all_text))
+    print('transform_whisper: original length = %d' % all_length)
     print('transform_whisper: after group length = %d' % texts_len)
     return texts
-        
 
-def translate(infos, trans_list = False):
+
+class Profiler(object):
     """
-        Args:
-            infos: list, 
-                [{
-                    'chars': int,
-                    'number': int,
-                    'end_order': int,
-                    'texts': list of str,
-                    'text_joined': str
-                },...]
-            translate_list: boolen, defautl False, whether to translate the texts list
-        Return: (list, list)
-            The first list:
-                [{
-                    'chars': int,
-                    'number': int,
-                    'end_order': int,
-                    'texts': list of str,
-                    'text_joined': str,
-                    'translated': list of str,  # the translated results for texts list
-                    'joined_translated': str   # the translated result for text_joined
-                },...]
-            The second list: pairs
+        wall time of each pipeline stage, counters and latency histograms, shared by all the threads.
+        With cpu = True, the stages marked cpu are also run under cProfile.
+        A worker process reports its own profiler with snapshot, merged into the main one with merge.
     """
+    buckets = (0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60)  # seconds, upper bounds of the histogram buckets
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cpu = False
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start = time.time()
+            self.stages = {}
+            self.counters = {
+                'chunks': 0,
+                'chars_sent': 0,
+                'requests': 0,
+                'retries': 0,
+                'cache_hits': 0,
+                'cues_written': 0
+            }
+            self.histograms = {}
+            self.cpu_profile = None
+            self.cpu_files = []
 
-    def translate_list(translator, info):
-        """"
-            pass list of str to translator, and return a list of translated text
+    @contextlib.contextmanager
+    def stage(self, name, cpu = False):
+        """
+            time the code in the with block as the stage name
+        """
+        profile = None
+        if cpu and self.cpu and not getattr(self.local, 'profiling', False):  # cProfile can not be nested
+            profile = cProfile.Profile()
+            self.local.profiling = True
+            profile.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                self.local.profiling = False
+            with self.lock:
+                info = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                info['seconds'] += elapsed
+                info['calls'] += 1
+                if profile is not None:
+                    if self.cpu_profile is None:
+                        self.cpu_profile = pstats.Stats(profile)
+                    else:
+                        self.cpu_profile.add(profile)
+
+    def count(self, name, n = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        """
+            add seconds to the histogram name
+        """
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {'count': 0, 'sum': 0.0, 'min': None, 'max': None, 'buckets': [0] * (len(self.buckets) + 1)})
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['min'] = seconds if histogram['min'] is None else min(histogram['min'], seconds)
+            histogram['max'] = seconds if histogram['max'] is None else max(histogram['max'], seconds)
+            index = 0
+            while index < len(self.buckets) and seconds > self.buckets[index]:
+                index += 1
+            histogram['buckets'][index] += 1
+
+    def snapshot(self, cpu_file = None):
+        """
             Args:
-                translator: Translator() obj instance
-                info: dict
-            Return: (list, list)
-                the second list is pairs
+                cpu_file: str, default None, dump the cProfile stats of this process there
+            Return: dict, picklable, for merge
         """
-        translated = []
-        pairs = []
-        # translate list of str
-        origin_texts = info['texts']
-        
-        translations = translator.translate(origin_texts, dest = 'zh-cn', src = 'en')
-        trans = []
-        trans_hash = {}
-        # print(translations)  # [<googletrans.models.Translated object at 0x7f82dc17d160>, <googletrans.models.Translated object at 0x7f82dc138198>,...]
-        
-        for translation in translations:  # if passed parameter is not list: TypeError: 'Translated' object is not iterable
-            origin = translation.origin
-            target = translation.text
-            trans_info = {
-                'origin': origin,
-                'target': target
+        with self.lock:
+            cpu_files = list(self.cpu_files)
+            if cpu_file is not None and self.cpu_profile is not None:
+                self.cpu_profile.dump_stats(cpu_file)
+                cpu_files.append(cpu_file)
+            return copy.deepcopy({
+                'stages': self.stages,
+                'counters': self.counters,
+                'histograms': self.histograms,
+                'cpu_files': cpu_files
+            })
+
+    def merge(self, snapshot):
+        with self.lock:
+            for name, info in snapshot['stages'].items():
+                mine = self.stages.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                mine['seconds'] += info['seconds']
+                mine['calls'] += info['calls']
+            for name, n in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, histogram in snapshot['histograms'].items():
+                mine = self.histograms.get(name)
+                if mine is None:
+                    self.histograms[name] = copy.deepcopy(histogram)
+                    continue
+                mine['count'] += histogram['count']
+                mine['sum'] += histogram['sum']
+                mine['min'] = min(mine['min'], histogram['min'])
+                mine['max'] = max(mine['max'], histogram['max'])
+                mine['buckets'] = [a + b for a, b in zip(mine['buckets'], histogram['buckets'])]
+            self.cpu_files.extend(snapshot['cpu_files'])
+
+    def report(self):
+        """
+            Return: dict
+        """
+        labels = ['<=%gs' % bucket for bucket in self.buckets] + ['>%gs' % self.buckets[-1]]
+        with self.lock:
+            histograms = {}
+            for name, histogram in self.histograms.items():
+                histograms[name] = {
+                    'count': histogram['count'],
+                    'mean': histogram['sum'] / histogram['count'],
+                    'min': histogram['min'],
+                    'max': histogram['max'],
+                    'buckets': dict(zip(labels, histogram['buckets']))
+                }
+            return {
+                'wall_seconds': time.time() - self.start,
+                'stages': copy.deepcopy(self.stages),
+                'counters': dict(self.counters),
+                'histograms': histograms
             }
-            # print(origin)
-            print(target)
-            trans.append(trans_info)
-            pairs.append(trans_info)
-            trans_hash[origin] = target
-            
-        new_info['trans_pairs'] = trans   # list of dict, pairs
-        translated = [
-            trans_hash[origin]
-            for origin in origin_texts
+
+    def dump(self, out_dir):
+        """
+            write profile.json, and profile_cpu.prof with the top functions in profile.json if cpu is on
+        """
+        report = self.report()
+        if self.cpu:
+            stats = None
+            with self.lock:
+                if self.cpu_profile is not None:
+                    stats = self.cpu_profile
+                for cpu_file in self.cpu_files:
+                    if stats is None:
+                        stats = pstats.Stats(cpu_file)
+                    else:
+                        stats.add(cpu_file)
+            if stats is not None:
+                cpu_file = os.path.join(out_dir, 'profile_cpu.prof')
+                stats.dump_stats(cpu_file)
+                top = io.StringIO()
+                stats.stream = top
+                stats.sort_stats('cumulative').print_stats(30)
+                report['cpu_file'] = cpu_file
+                report['cpu_top'] = top.getvalue().splitlines()
+        json_profile = os.path.join(out_dir, 'profile.json')
+        dump_json(_file = json_profile, _dict = report)
+        print('profile: %s' % json_profile)
+
+profiler = Profiler()
+
+
+def profiled_call(func, cpu = False, cpu_file = None, **kwargs):
+    """
+        run func in a worker process with a fresh profiler
+        Args:
+            cpu: boolean, see Profiler
+            cpu_file: str, where the cProfile stats of the worker are dumped
+        Return: (the result of func, the profiler snapshot)
+    """
+    profiler.reset()
+    profiler.cpu = cpu
+    result = func(**kwargs)
+    return result, profiler.snapshot(cpu_file = cpu_file)
+
+
+class TranslationCache(object):
+    """
+        sqlite backed translation cache, keyed by the hash of the normalized source text, src, dest and backend.
+        When the size of the cached texts goes over max_bytes, the least recently used translations are evicted down to low_water * max_bytes,
+        so the next puts do not evict again. The texts are read and written in batches, one commit a batch.
+        Args:
+            path: str, path to the sqlite file
+            max_bytes: int, max size in bytes of the cached source and target texts
+    """
+    low_water = 0.9
+
+    def __init__(self, path, max_bytes = 200 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()  # the connection is shared by the translation workers
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, target TEXT, size INTEGER, used REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS translations_used ON translations (used)')
+        self.conn.commit()
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM translations').fetchone()[0]
+
+    @staticmethod
+    def make_key(text, src, dest, backend):
+        """
+            the whitespace of text is normalized, so " Thank you. " and "Thank you." share a key
+            Return: str, hex digest
+        """
+        normalized = ' '.join(text.split())
+        raw = '\x1f'.join([backend, src, dest, normalized])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, text, src, dest, backend):
+        """
+            Return: str, the cached translation; None if not cached
+        """
+        return self.get_many([text], src, dest, backend)[0]
+
+    def get_many(self, texts, src, dest, backend):
+        """
+            Args:
+                texts: list of str
+            Return: list, the cached translation of each text, None if not cached
+        """
+        keys = [self.make_key(text, src, dest, backend) for text in texts]
+        with self.lock:
+            targets = []
+            used = []
+            for key in keys:
+                row = self.conn.execute('SELECT target FROM translations WHERE key = ?', (key,)).fetchone()
+                targets.append(None if row is None else row[0])
+                if row is not None:
+                    used.append(key)
+            self.hits += len(used)
+            self.misses += len(keys) - len(used)
+            if len(used) > 0:
+                now = time.time()
+                self.conn.executemany('UPDATE translations SET used = ? WHERE key = ?', [(now, key) for key in used])
+                self.conn.commit()
+        return targets
+
+    def put(self, text, src, dest, backend, target):
+        self.put_many([(text, target)], src, dest, backend)
+
+    def put_many(self, items, src, dest, backend):
+        """
+            Args:
+                items: list of (str, str), the texts and their translations
+        """
+        now = time.time()
+        rows = []
+        for text, target in items:
+            size = len(text.encode('utf-8')) + len(target.encode('utf-8'))
+            rows.append((self.make_key(text, src, dest, backend), target, size, now))
+        with self.lock:
+            for key, _, size, _ in rows:
+                row = self.conn.execute('SELECT size FROM translations WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self.size -= row[0]
+                self.size += size
+            self.conn.executemany('INSERT OR REPLACE INTO translations (key, target, size, used) VALUES (?, ?, ?, ?)', rows)
+            if self.size > self.max_bytes:
+                self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        """
+            remove the least recently used translations until the cache fits low_water * max_bytes, the caller holds the lock
+        """
+        target_size = int(self.max_bytes * self.low_water)
+        keys = []
+        cursor = self.conn.execute('SELECT key, size FROM translations ORDER BY used')
+        for key, size in cursor:
+            if self.size <= target_size:
+                break
+            keys.append((key,))
+            self.size -= size
+        cursor.close()
+        self.conn.executemany('DELETE FROM translations WHERE key = ?', keys)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+        print('translation cache: hits = %d, misses = %d, size = %d bytes' %(self.hits, self.misses, self.size))
+
+
+class Deduplicator(object):
+    """
+        the translations of one run, so each distinct text is sent once even if it repeats across the cues, chunks and files.
+        Texts are the same if their TranslationCache keys are, i.e. equal but for the whitespace.
+        The first worker to claim a text translates it, the others wait for its result; a failed text is released to be sent again.
+        Shared by all the translation workers.
+    """
+    def __init__(self):
+        self.futures = {}  # key -> Future of the translated str
+        self.lock = threading.Lock()
+        self.duplicates = 0
+        self.chars_saved = 0
+
+    def claim(self, texts, src, dest, backend):
+        """
+            Args:
+                texts: list of str
+            Return: (list, dict)
+                the Future of the translation of each text, in the same order, failed with the error of its owner if it is released
+                the texts this caller has to translate: {key: str}, the first one of the texts for each key not claimed yet
+        """
+        futures = []
+        owned = {}
+        with self.lock:
+            for text in texts:
+                key = TranslationCache.make_key(text, src, dest, backend)
+                future = self.futures.get(key)
+                if future is None:
+                    future = self.futures[key] = Future()
+                    owned[key] = text
+                else:
+                    self.duplicates += 1
+                    self.chars_saved += len(text)
+                futures.append(future)
+        return futures, owned
+
+    def resolve(self, key, target):
+        self.futures[key].set_result(target)
+
+    def release(self, keys, error):
+        """
+            fail the waiters of keys not translated yet, and forget the keys so they are sent again next time
+        """
+        with self.lock:
+            for key in keys:
+                future = self.futures.get(key)
+                if future is not None and not future.done():
+                    del self.futures[key]
+                    future.set_exception(error)
+
+    def report(self):
+        profiler.count('duplicates', self.duplicates)
+        profiler.count('chars_saved', self.chars_saved)
+        print('dedup: %d texts, %d duplicates not sent, %d chars saved' %(len(self.futures), self.duplicates, self.chars_saved))
+
+
+class TranslatorBackend(object):
+    """
+        the interface of translator backends
+        translate_batch takes a list of str and returns the list of translated str in the same order.
+        One call should not take more than max_batch_items texts or max_batch_chars chars, use make_batches to split.
+        Backends are shared by the translation workers, so translate_batch should be thread safe.
+    """
+    name = 'base'  # part of the cache key
+    max_batch_chars = 5000
+    max_batch_items = 100
+
+    def translate_batch(self, texts, src = 'en', dest = 'zh-cn'):
+        """
+            Args:
+                texts: list of str
+                src: str, source language
+                dest: str, target language
+            Return: list of str
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """
+            release the connections, called once at the end of the run
+        """
+        pass
+
+
+class TranslateError(Exception):
+    """
+        a failed translation request
+        Args:
+            retry_after: float, seconds the server asked to wait before the next request, None if not told
+    """
+    def __init__(self, message, retry_after = None):
+        super(TranslateError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """
+        the Retry-After header, either seconds or an http date
+        Return: float, seconds to wait, None if value is empty or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo = datetime.timezone.utc)
+    return max((when - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0.0)
+
+
+class GoogleTransBackend(TranslatorBackend):
+    """
+        googletrans adapter
+        The proxy and timeout are set once on the Translator, whose http client keeps its connections alive between the requests.
+        The Translators are pooled by the backend, so they stay warm across the translate calls, files and jobs of the run,
+        and there are never more of them than requests at the same time; close() closes their http clients.
+        Failures are raised as TranslateError with the Retry-After of the last response, if any.
+        Args:
+            proxy: str, such as 'http://127.0.0.1:10809', None for no proxy
+            timeout: float, seconds before a request times out
+    """
+    name = 'googletrans'
+    max_batch_chars = 15000  # google refuses longer text
+    max_batch_items = 100
+
+    def __init__(self, proxy = None, timeout = 30.0):
+        from googletrans import Translator
+        self.translator_class = Translator
+        self.proxies = None if not proxy else {'http://': proxy, 'https://': proxy}
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()  # the translators not in use, the last used, with the warmest connections, first
+        self.translators = []
+        self.lock = threading.Lock()
+
+    def new_translator(self):
+        """
+            Return: dict, the Translator and the Retry-After of its last response
+        """
+        kwargs = {'timeout': self.timeout, 'raise_exception': True}
+        if self.proxies is not None:
+            kwargs['proxies'] = self.proxies
+        pooled = {'translator': self.translator_class(**kwargs), 'retry_after': None}
+        client = getattr(pooled['translator'], 'client', None)
+        if client is not None and hasattr(client, 'event_hooks'):  # httpx.Client, to see the status and headers of the responses
+            hooks = client.event_hooks
+            hooks['response'].append(lambda response: pooled.update(retry_after = response.headers.get('Retry-After')))
+            client.event_hooks = hooks
+        with self.lock:
+            self.translators.append(pooled)
+        return pooled
+
+    def translate_batch(self, texts, src = 'en', dest = 'zh-cn'):
+        # Translator() holds its own http client, so one request uses one translator at a time
+        try:
+            pooled = self.idle.get_nowait()
+        except queue.Empty:
+            pooled = self.new_translator()
+        translator = pooled['translator']
+        pooled['retry_after'] = None
+        try:
+            if len(texts) == 1:
+                return [translator.translate(texts[0], dest = dest, src = src).text]
+            translations = translator.translate(texts, dest = dest, src = src)
+        except Exception as e:
+            raise TranslateError('%s: %s' %(type(e).__name__, format(e)), retry_after = parse_retry_after(pooled['retry_after'])) from e
+        finally:
+            self.idle.put(pooled)
+        # print(translations)  # [<googletrans.models.Translated object at 0x7f82dc17d160>, <googletrans.models.Translated object at 0x7f82dc138198>,...]
+        return [translation.text for translation in translations]
+
+    def close(self):
+        with self.lock:
+            for pooled in self.translators:
+                client = getattr(pooled['translator'], 'client', None)
+                if client is not None and hasattr(client, 'close'):
+                    client.close()
+            self.translators = []
+
+
+class StubBackend(TranslatorBackend):
+    """
+        deterministic offline backend for load tests, no network is used
+        The text is returned unchanged except for zh/ja: the sentence ends found by segmenter are mapped to the Chinese punctuation,
+        and the other dots, of Mr., U.S., A.I. or the initials, to the middle dot as in 霍华德·K·史密斯,
+        so the translation has the sentences of the English, as a real one, and the sentence splitting in to_srt works the same.
+        Args:
+            latency: float, seconds to sleep for every request
+            latency_per_char: float, extra seconds to sleep for every char in the request
+    """
+    name = 'stub'
+    full_width = {'.': '。', '?': '？', '!': '！', '...': '……'}
+    inner_dot = re.compile(r'(?<!\d)\.|\.(?!\d)')  # not a decimal point
+
+    def __init__(self, latency = 0.0, latency_per_char = 0.0):
+        self.latency = latency
+        self.latency_per_char = latency_per_char
+
+    def translate_batch(self, texts, src = 'en', dest = 'zh-cn'):
+        delay = self.latency + self.latency_per_char * sum(len(text) for text in texts)
+        if delay > 0:
+            time.sleep(delay)
+        if not dest.split('-')[0] in ('zh', 'ja'):
+            return list(texts)
+        return [self.to_full_width(text.strip(' ')) for text in texts]
+
+    def to_full_width(self, text):
+        pieces = []
+        start = 0
+        for offset in segmenter.boundaries(text):
+            end = offset - 3 if text.endswith('...', 0, offset) else offset - 1
+            pieces.append(self.inner_dot.sub('·', text[start:end].lstrip(' ')) + self.full_width[text[end:offset]])
+            start = offset
+        pieces.append(self.inner_dot.sub('·', text[start:].lstrip(' ')))
+        return ''.join(pieces)
+
+
+class CircuitBreaker(object):
+    """
+        shared by all the translation workers, so they back off together:
+        after threshold failures in a row, or when the server asks to wait with Retry-After, no request is sent until the pause is over.
+        Args:
+            threshold: int, failures in a row to open the breaker
+            cooldown: float, seconds the breaker stays open
+    """
+    def __init__(self, threshold = 5, cooldown = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+            block while the breaker is open
+        """
+        with self.lock:
+            pause = self.open_until - time.monotonic()
+        if pause > 0:
+            time.sleep(pause)
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+
+    def failure(self, pause = None):
+        """
+            Args:
+                pause: float, seconds all the workers should wait, such as the Retry-After
+        """
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                pause = max(pause or 0.0, self.cooldown)
+                print('circuit breaker: %d failures in a row, pause %.1f seconds' %(self.failures, pause))
+            if pause:
+                self.open_until = max(self.open_until, time.monotonic() + pause)
+
+
+class RetryingBackend(TranslatorBackend):
+    """
+        retry the failed requests of another backend with jittered exponential backoff, waiting at least the Retry-After
+        Args:
+            backend: TranslatorBackend, the wrapped one, its name and limits are kept so the cache keys do not change
+            retries: int, times a request is retried
+            backoff: float, seconds before the first retry, doubled for each next one and capped at max_backoff
+            breaker: CircuitBreaker, default None for a new one
+    """
+    max_backoff = 60.0
+
+    def __init__(self, backend, retries = 5, backoff = 1.0, breaker = None):
+        self.backend = backend
+        self.name = backend.name
+        self.max_batch_chars = backend.max_batch_chars
+        self.max_batch_items = backend.max_batch_items
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker() if breaker is None else breaker
+
+    def translate_batch(self, texts, src = 'en', dest = 'zh-cn'):
+        attempt = 0
+        while True:
+            self.breaker.wait()
+            try:
+                targets = self.backend.translate_batch(texts, src = src, dest = dest)
+            except Exception as e:
+                retry_after = getattr(e, 'retry_after', None)
+                self.breaker.failure(pause = retry_after)
+                if attempt >= self.retries:
+                    raise
+                attempt += 1
+                delay = random.uniform(0, min(self.backoff * 2 ** (attempt - 1), self.max_backoff))  # full jitter
+                delay = max(delay, retry_after or 0.0)
+                profiler.count('retries')
+                print('translate request failed (%s), retry %d/%d in %.1f seconds' %(format(e), attempt, self.retries, delay))
+                time.sleep(delay)
+                continue
+            self.breaker.success()
+            return targets
+
+    def close(self):
+        self.backend.close()
+
+
+class Glossary(object):
+    """
+        terms kept out of the translator: masked by placeholders before a text is sent, restored after,
+        as the term itself (product names and the like) or as its given translation.
+        The terms are matched as whole words by one TermMatcher, so thousands of terms cost one scan per text.
+        Args:
+            terms: list of str
+            targets: list of str, the translation of each term, None or '' to keep the term as it is
+    """
+    placeholder = '⟦%d⟧'  # left alone by the translators
+    placeholders = re.compile(r'⟦\s*(\d+)\s*⟧')  # the translator may add spaces
+
+    def __init__(self, terms, targets = None):
+        self.terms = list(terms)
+        self.targets = list(targets) if targets is not None else [None] * len(self.terms)
+        self.matcher = TermMatcher(self.terms, whole_word = True)
+        self.key = hash_json([self.terms, self.targets])
+
+    def mask(self, text):
+        """
+            Return: str, text with the terms replaced by placeholders
+        """
+        parts = []
+        start = 0
+        for term_start, term_end, index in self.matcher.find(text):
+            parts.append(text[start:term_start])
+            parts.append(self.placeholder % index)
+            start = term_end
+        if start == 0:
+            return text
+        parts.append(text[start:])
+        return ''.join(parts)
+
+    def restore(self, text):
+        """
+            Return: str, the placeholders in the translated text replaced by the terms or their translations
+        """
+        def term(m):
+            index = int(m.group(1))
+            if index >= len(self.terms):
+                return m.group(0)
+            return self.targets[index] or self.terms[index]
+        return self.placeholders.sub(term, text)
+
+
+def load_glossary(path):
+    """
+        one term a line, optionally followed by a tab and its translation; blank lines and lines starting with # are skipped
+        Return: Glossary
+    """
+    terms = []
+    targets = []
+    with open(path, 'r', encoding = 'utf-8') as fp:
+        for line in fp:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            term, _, target = line.partition('\t')
+            terms.append(term.strip())
+            targets.append(target.strip() or None)
+    print('glossary: %d terms from %s' %(len(terms), path))
+    return Glossary(terms, targets)
+
+
+class GlossaryBackend(TranslatorBackend):
+    """
+        mask the glossary terms before another backend translates, restore them after.
+        The name has the hash of the glossary, so a changed glossary does not reuse the cached translations and checkpoints.
+        Args:
+            backend: TranslatorBackend, the wrapped one
+            glossary: Glossary
+    """
+    def __init__(self, backend, glossary):
+        self.backend = backend
+        self.glossary = glossary
+        self.name = '%s+glossary-%s' %(backend.name, glossary.key[:12])
+        self.max_batch_chars = backend.max_batch_chars
+        self.max_batch_items = backend.max_batch_items
+
+    def translate_batch(self, texts, src = 'en', dest = 'zh-cn'):
+        targets = self.backend.translate_batch([self.glossary.mask(text) for text in texts], src = src, dest = dest)
+        return [self.glossary.restore(target) for target in targets]
+
+    def close(self):
+        self.backend.close()
+
+
+def make_backend(args):
+    """
+        build the translator backend from the parsed arguments
+        Return: TranslatorBackend
+    """
+    if args.backend == 'stub':
+        backend = StubBackend(latency = args.stub_latency)
+    else:
+        backend = GoogleTransBackend(proxy = args.proxy, timeout = args.timeout)
+    if args.retries > 0:
+        backend = RetryingBackend(backend, retries = args.retries, backoff = args.backoff)
+    if args.glossary:
+        backend = GlossaryBackend(backend, load_glossary(args.glossary))
+    return backend
+
+
+def make_batches(texts, backend):
+    """
+        split texts into batches within backend.max_batch_items and backend.max_batch_chars,
+        a single text longer than max_batch_chars is sent alone
+        Return: list of list of str
+    """
+    batches = []
+    batch = []
+    chars = 0
+    for text in texts:
+        if len(batch) > 0 and (len(batch) >= backend.max_batch_items or chars + len(text) > backend.max_batch_chars):
+            batches.append(batch)
+            batch = []
+            chars = 0
+        batch.append(text)
+        chars += len(text)
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+class RateLimiter(object):
+    """
+        global rate limit shared by all the translation workers, calls are spaced evenly
+        Args:
+            rate: float, max requests per second, None or 0 means no limit
+    """
+    def __init__(self, rate = None):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+            block until the caller is allowed to send the next request
+        """
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            allowed = max(self.next_time, now)
+            self.next_time = allowed + self.interval
+        if allowed > now:
+            time.sleep(allowed - now)
+
+
+class AdaptiveSizer(object):
+    """
+        the chunk size in chars for one backend, learned from the request latencies and failures.
+        The size grows while the requests finish within latency_budget, shrinks when they take longer and is halved on a failure.
+        The throughput of each size (rounded to step chars) is saved to path, so the next run starts from the best size seen.
+        Only the requests near the current size are measured, and a size needs min_samples of them to be the best,
+        so a run on a small file, whose requests are all small, does not teach the next runs to send small requests.
+        Shared by all the translation workers.
+        Args:
+            path: str, the json file of the learned sizes of all the backends, None for not saved
+            backend: TranslatorBackend, its name keys the saved sizes, its max_batch_chars bounds the size
+            size: int, the size to start from if nothing was saved for the backend
+            latency_budget: float, seconds a request should not exceed
+    """
+    step = 500
+    min_size = 500
+    grow = 1.25
+    shrink = 0.75
+    min_samples = 3
+
+    def __init__(self, path = None, backend = None, size = 10000, latency_budget = 10.0):
+        self.path = path
+        self.name = 'base' if backend is None else backend.name
+        self.max_size = TranslatorBackend.max_batch_chars if backend is None else backend.max_batch_chars
+        self.latency_budget = latency_budget
+        self.throughputs = {}  # str(size) -> chars per second, averaged
+        self.samples = {}  # str(size) -> the number of requests measured
+        self.lock = threading.Lock()
+        saved = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as fp:
+                saved = json.load(fp).get(self.name, {})
+        self.throughputs = saved.get('throughputs', {})
+        self.samples = saved.get('samples', {})
+        best = self.best_size()
+        self.size = self.bound(best if best is not None else saved.get('size', size))
+
+    def bound(self, size):
+        return int(min(max(size, self.min_size), self.max_size))
+
+    def best_size(self):
+        """
+            Return: int, the size of the highest chars per second among those measured min_samples times, None if there is none
+        """
+        sizes = [size for size in self.throughputs if self.samples.get(size, 0) >= self.min_samples]
+        if len(sizes) == 0:
+            return None
+        return int(max(sizes, key = lambda size: self.throughputs[size]))
+
+    def observe(self, chars, seconds):
+        """
+            record a successful request of chars taking seconds
+        """
+        if chars <= 0:
+            return
+        with self.lock:
+            near = chars >= self.size * 0.8  # only a request near the size tells how the size does
+            if near:
+                bucket = str(max(int(round(chars / float(self.step))), 1) * self.step)
+                speed = chars / max(seconds, 1e-6)
+                old = self.throughputs.get(bucket)
+                self.throughputs[bucket] = speed if old is None else 0.7 * old + 0.3 * speed
+                self.samples[bucket] = self.samples.get(bucket, 0) + 1
+            if seconds > self.latency_budget:
+                self.size = self.bound(min(self.size, chars) * self.shrink)
+            elif near:
+                self.size = self.bound(self.size * self.grow)
+
+    def failed(self, chars):
+        """
+            record a failed request of chars
+        """
+        with self.lock:
+            self.size = self.bound(min(self.size, chars) / 2)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            sizes = {}
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as fp:
+                    sizes = json.load(fp)
+            sizes[self.name] = {
+                'size': self.size,
+                'best_size': self.best_size(),
+                'throughputs': self.throughputs,
+                'samples': self.samples
+            }
+            dump_json_atomic(_file = self.path, _dict = sizes)
+        print('chunk size for %s: %d chars, best %s' %(self.name, self.size, sizes[self.name]['best_size']))
+
+
+def split_repeats(texts):
+    """
+        split texts around the segments that are a whole sentence (after a sentence end and ending one, see is_sentence_end)
+        and appear more than once, such as "Thank you." said again and again, so that each is sent once and its copies come from the Deduplicator.
+        The pieces start and end at sentence ends, so their translations joined are still the sentences of texts.
+        Return: list of list of str, the pieces in order, [texts] if no such segment repeats
+    """
+    keys = [' '.join(text.split()) for text in texts]
+    ends = [is_sentence_end(text) for text in texts]
+    whole = [ends[i] and (i == 0 or ends[i - 1]) for i in range(len(texts))]
+    counts = {}
+    for key, is_whole in zip(keys, whole):
+        if is_whole:
+            counts[key] = counts.get(key, 0) + 1
+    if all(count < 2 for count in counts.values()):
+        return [texts]
+    pieces = []
+    piece = []
+    for text, key, is_whole in zip(texts, keys, whole):
+        if is_whole and counts[key] > 1:
+            if len(piece) > 0:
+                pieces.append(piece)
+                piece = []
+            pieces.append([text])
+        else:
+            piece.append(text)
+    if len(piece) > 0:
+        pieces.append(piece)
+    return pieces
+
+
+def halve_texts(texts):
+    """
+        where to split a list of segments into two of about the same chars, at a sentence end if there is one
+        Return: int, the number of segments in the first half, 0 < cut < len(texts)
+    """
+    half = sum(len(text) + 1 for text in texts) / 2.0
+    cut = max(len(texts) // 2, 1)
+    best = None
+    chars = 0
+    for i, text in enumerate(texts[:-1]):
+        chars += len(text) + 1
+        if is_sentence_end(text) and (best is None or abs(chars - half) < best):
+            best = abs(chars - half)
+            cut = i + 1
+    return cut
+
+
+def translate(infos, trans_list = False, workers = 1, rate = None, cache = None, backend = None, src = 'en', dest = 'zh-cn', limiter = None, checkpoint_dir = None, sizer = None, dedup = None):
+    """
+        Args:
+            infos: list, 
+                [{
+                    'chars': int,
+                    'number': int,
+                    'end_order': int,
+                    'texts': list of str,
+                    'text_joined': str
+                },...]
+            translate_list: boolen, defautl False, whether to translate the texts list
+            workers: int, default 1, how many chunks are translated at the same time
+            rate: float, default None, max requests per second for all the workers, None means no limit
+            cache: TranslationCache, default None, checked before any text is sent to the translator
+            backend: TranslatorBackend, default None means GoogleTransBackend without proxy
+            src: str, source language
+            dest: str, target language
+            limiter: RateLimiter, default None, shared with other translate calls, rate is ignored if it is passed
+            checkpoint_dir: str, default None, each translated chunk is saved there as chunk_<i>.json with the hash of its input,
+                and loaded instead of translated again if the hash still matches
+            sizer: AdaptiveSizer, default None, text_joined longer than sizer.size is sent in pieces split at the segments,
+                and a failed request is split in half and retried instead of aborting the run
+            dedup: Deduplicator, default None for a new one, shared with other translate calls to send each text once per run
+        Return: (list, list)
+            The first list, in the same order as infos:
+                [{
+                    'chars': int,
+                    'number': int,
+                    'end_order': int,
+                    'texts': list of str,
+                    'text_joined': str,
+                    'translated': list of str,  # the translated results for texts list
+                    'joined_translated': str   # the translated result for text_joined
+                },...]
+            The second list: pairs
+    """
+
+    def translate_texts(texts):
+        """
+            translate list of str in batches allowed by the backend,
+            the texts already translated in this run and the cached ones are not sent
+            Return: list of str
+        """
+        futures, owned = dedup.claim(texts, src, dest, backend.name)
+        try:
+            to_trans = []
+            origin_keys = {}
+            cached = [None] * len(owned) if cache is None else cache.get_many(list(owned.values()), src, dest, backend.name)
+            for (key, origin), target in zip(owned.items(), cached):
+                if target is None:
+                    to_trans.append(origin)
+                    origin_keys[origin] = key
+                else:
+                    dedup.resolve(key, target)
+                    profiler.count('cache_hits')
+
+            for batch in make_batches(to_trans, backend):
+                limiter.wait()
+                start = time.perf_counter()
+                targets = backend.translate_batch(batch, src = src, dest = dest)
+                elapsed = time.perf_counter() - start
+                chars = sum(len(origin) for origin in batch)
+                profiler.observe('request_latency', elapsed)
+                profiler.count('requests')
+                profiler.count('chars_sent', chars)
+                if sizer is not None:
+                    sizer.observe(chars, elapsed)
+                for origin, target in zip(batch, targets):
+                    dedup.resolve(origin_keys[origin], target)
+                if cache is not None:
+                    cache.put_many(list(zip(batch, targets)), src, dest, backend.name)
+        except BaseException as e:
+            dedup.release(owned, e)
+            raise
+        return [
+            future.result()  # waits for the texts claimed by the other workers
+            for future in futures
         ]
+
+    def translate_pieces(text_joined, pieces, lookup = True):
+        """
+            translate text_joined as the pieces, each a list of str; the whole text_joined is cached too,
+            as the pieces depend on the learned sizer.size and on the repeats, and a rerun with other pieces should still hit the cache
+            Args:
+                lookup: boolean, look text_joined up in the cache first, False if it was just missed
+            Return: str
+        """
+        target = None if cache is None or not lookup else cache.get(text_joined, src, dest, backend.name)
+        if target is not None:
+            profiler.count('cache_hits')
+            return target
+        target = ' '.join(translate_joined(piece) for piece in pieces)
+        if cache is not None:
+            cache.put(text_joined, src, dest, backend.name, target)
+        return target
+
+    def translate_joined(texts):
+        """
+            translate ' '.join(texts), the repeated sentences apart (see split_repeats), in pieces of sizer.size split at the segments
+            Return: str
+        """
+        text_joined = ' '.join(texts)
+        pieces = split_repeats(texts)
+        if len(pieces) > 1:
+            return translate_pieces(text_joined, pieces)
+        if sizer is None:
+            return translate_texts([text_joined])[0]
+        if len(texts) > 1 and len(text_joined) > sizer.size:
+            return translate_pieces(text_joined, [piece for piece, _ in group_texts(texts, chars_limit = sizer.size)])
+        try:
+            return translate_texts([text_joined])[0]
+        except Exception as e:
+            if len(texts) < 2 or len(text_joined) <= sizer.min_size:
+                raise
+            sizer.failed(len(text_joined))
+            profiler.count('retries')
+            print('translate failed for %d chars, retry in halves: %s' %(len(text_joined), format(e)))
+            cut = halve_texts(texts)
+            return translate_pieces(text_joined, [texts[:cut], texts[cut:]], lookup = False)
+
+    def translate_list(info, new_info):
+        """"
+            pass list of str to translator, and return a list of translated text
+            Args:
+                info: dict
+                new_info: dict, the trans_pairs will be added
+            Return: (list, list)
+                the second list is pairs
+        """
+        origin_texts = info['texts']
+        translated = translate_texts(origin_texts)
+        pairs = []
+        for origin, target in zip(origin_texts, translated):
+            print(target)
+            pairs.append({
+                'origin': origin,
+                'target': target
+            })
+        new_info['trans_pairs'] = pairs   # list of dict, pairs
         return translated, pairs      
 
-    translator = Translator()
-    new_infos = []
-    pairs = []
-    i = 0
-    for info in infos:
-        i += 1
-        new_info = copy.deepcopy(info)
+    def translate_info(i, info):
+        """
+            translate one chunk
+            Return: (dict, list), the new info and its pairs
+        """
+        if checkpoint_dir is not None:
+            checkpoint = os.path.join(checkpoint_dir, 'chunk_%04d.json' % i)
+            key = hash_json([info['text_joined'], info['texts'] if trans_list else None, backend.name, src, dest])
+            if os.path.exists(checkpoint):
+                with open(checkpoint, 'r') as fp:
+                    saved = json.load(fp)
+                if saved['key'] == key:
+                    print('translated %d: loaded %s' %(i, checkpoint))
+                    return saved['info'], saved['pairs']
+
+        new_info = dict(info)  # texts is shared, not changed
+        pairs = []
 
         # translate joined str
         print('translating %d: chars = %d' %(i, info['chars']))
-        text_joined = info['text_joined']
-        translation = translator.translate(text_joined, proxies={'http://': 'http://127.0.0.1:10809', 'https://': 'http://127.0.0.1:10809'}, dest = 'zh-cn', src = 'en')
-        target = translation.text
-        new_info['joined_translated'] = target  # str
+        start = time.perf_counter()
+        new_info['joined_translated'] = translate_joined(info['texts'])  # str
 
         if trans_list:
-            new_info['translated'], pairs = translate_list(translator=translator, info=info)   # list of str
+            new_info['translated'], pairs = translate_list(info=info, new_info=new_info)   # list of str
+        profiler.observe('chunk_latency', time.perf_counter() - start)
+        profiler.count('chunks')
+        if checkpoint_dir is not None:
+            dump_json_atomic(_file = checkpoint, _dict = {'key': key, 'info': new_info, 'pairs': pairs})
+        return new_info, pairs
+
+    if backend is None:
+        backend = GoogleTransBackend()
+    if limiter is None:
+        limiter = RateLimiter(rate = rate)
+    if dedup is None:
+        dedup = Deduplicator()
+    if checkpoint_dir is not None and not os.path.exists(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    numbers = range(1, len(infos) + 1)
+    if workers > 1 and len(infos) > 1:
+        # map keeps the chunk order, so end_order still matches when the results are joined in to_srt
+        with ThreadPoolExecutor(max_workers = workers) as executor:
+            results = list(executor.map(translate_info, numbers, infos))
+    else:
+        results = [translate_info(i, info) for i, info in zip(numbers, infos)]
 
+    new_infos = []
+    pairs = []
+    for new_info, info_pairs in results:
         new_infos.append(new_info)
+        pairs.extend(info_pairs)  # pairs of all chunks, in the same order as the transcripts to combine
     return new_infos, pairs
 
 
-def to_combine(json_transcripts, json_pairs):
+def to_combine(json_transcripts = None, json_pairs = None, transcripts = None, pairs = None, out_dir = 'translated'):
     """
         Args:
             json_transcripts: str, path to input json
             json_pairs: str, path to json pairs
+            transcripts: list, the standardized transcripts already in memory, the json files are not read if it is passed
+            pairs: list, the pairs already in memory, used together with transcripts
+            out_dir: str, the output directory
     """
-    out_dir = 'translated'
     if not os.path.exists(out_dir):
-        os.mkdir(out_dir) 
+        os.makedirs(out_dir) 
     # combine translated transcripts with the original one
     # json_pairs = os.path.join(out_dir, 'translated_pairs.json')
-    combines, empty_pairs = combine(json_transcripts = json_transcripts, json_pairs = json_pairs)
+    if transcripts is None:
+        combines, empty_pairs = combine(json_transcripts = json_transcripts, json_pairs = json_pairs)
+    else:
+        combines, empty_pairs = combine_lists(transcripts = transcripts, pairs = pairs or [])
 
     # dump to file
     json_combine = os.path.join(out_dir, 'combines_translated.json')
@@ -594,6 +2359,53 @@ def to_combine(json_transcripts, json_pairs):
     return combines, empty_pairs 
 
 
+_zh_sentence_end = re.compile(
+    r'(?P<end>……|\.{6}|[。？！])'  # the Chinese …… maps English ...
+    r'|(?<=[^\d.])(?P<dot>\.)(?=[^\d.])'  # sometimes Google Translation gets "这是上一句子.这是下一句子。", it might be risky that, some . will be replaced by mistake.
+    r'|(?P<newline>\n)'
+)
+
+def split_sentences_zh(text):
+    """
+        split the translated Chinese text into sentences in one scan,
+        a single . between non-digits is taken as 。, a line break also ends a sentence but is dropped
+        Args:
+            text: str
+        Return: (list, list)
+            list of str, the sentences, ended by 。？！…… or ......
+            list of (int, int), the span of each sentence in text
+    """
+    sentences = []
+    spans = []
+    start = 0
+    for m in _zh_sentence_end.finditer(text):
+        if m.lastgroup == 'newline':
+            sentences.append(text[start:m.start()])
+            spans.append((start, m.start()))
+        elif m.lastgroup == 'dot':
+            sentences.append(text[start:m.start()] + '。')
+            spans.append((start, m.end()))
+        else:
+            sentences.append(text[start:m.end()])
+            spans.append((start, m.end()))
+        start = m.end()
+    if start < len(text):  # the last one without end
+        sentences.append(text[start:])
+        spans.append((start, len(text)))
+    return sentences, spans
+
+
+def split_sentences(text, lang = 'zh-cn'):
+    """
+        split the translated text into sentences, by split_sentences_zh for Chinese and Japanese, by segmenter for the others
+        Return: (list, list), see split_sentences_zh
+    """
+    if lang.split('-')[0] in ('zh', 'ja'):
+        return split_sentences_zh(text)
+    spans = segmenter.split(text)
+    return [text[start:end].strip() for start, end in spans], spans
+
+
 def unique_list(_list):
     """
         remove duplicated members in list
@@ -603,7 +2415,413 @@ def unique_list(_list):
     unique_set = set(_list)
     return list(unique_set)
 
-def to_srt(translated, combines, empty_pairs = True, name = 'sentences_en_cn'):
+def align_greedy(combines, joined_translated_list):
+    """
+        give each cue as many translated sentences as judge_sentence_en_2 counts in it, one after another.
+        One miscounted sentence shifts all the later cues, and the cues after the last sentence are dropped.
+        Args:
+            combines: list of Cue
+            joined_translated_list: list of str, the translated sentences
+        Return: list of Cue, with cn_subtitle
+    """
+    len_joined = len(joined_translated_list)
+    len_combines = len(combines) # the number of lines in original whisper srt
+    # normally len(joined_translated_list) is smaller than/equal to/greater than len(combines)
+    new_combines = []
+    i = 0
+    c = 0
+    cc= 0
+    all_processed = True
+    logged = False
+    counts_list = segmenter.count_many([transcript['text'] for transcript in combines])
+    for transcript, counts in zip(combines, counts_list):     
+        # print('%s - %s: %s' %(transcript['in'], transcript['out'], transcript['text']))
+        # order = transcript['order']
+        # print(order)
+        c += 1
+        new_transcript = Cue.from_dict(transcript)  # cn_subtitle is added to the same cue
+        
+        # judge how many sentence
+        #text = transcript['target']
+        cc += counts
+        # print('loop c = %d: joined translated index i / len = %d / %d, accumulated judge sentence cc = %d, current line count = %d' %(c, i, len_joined, cc, counts))
+        if i > len_joined - 1:
+            all_processed = False
+            if not logged:
+                logged = True
+                logs = 'processed / original whisper srt = %d / %d' % (c - 1, len_combines)
+            continue  # temporary solution; to continue to static sentences en, not break
+        if counts == 0:
+            new_transcript['cn_subtitle'] = joined_translated_list[i]
+        else:
+            cn_subtitle = ''
+            for j in range(counts):
+                if i > len_joined - 1:
+                    all_processed = False
+                    logs_j = 'out of index while adding up sentences. i = %d' % i
+                    logs = 'processed / original whisper srt = %d / %d' % (c - 1, len_combines)
+                    print(logs_j)
+                    break
+                if cn_subtitle == '':
+                    cn_subtitle = joined_translated_list[i]
+                else:
+                    cn_subtitle = '\r\n'.join([cn_subtitle, joined_translated_list[i]])
+                i += 1
+            new_transcript['cn_subtitle'] = cn_subtitle        
+        new_combines.append(new_transcript)
+    print('accumulated judged sentences en = %d' % cc)
+    if all_processed:
+        print('all processed.')
+    else:
+        print(logs)
+    return new_combines
+
+
+def gale_church_cost(delta):
+    """
+        -log of the probability that a length difference is at least |delta| standard deviations, as in Gale & Church 1993
+    """
+    p = math.erfc(abs(delta) / math.sqrt(2))
+    return -math.log(max(p, 1e-12))
+
+
+def align_sentences(counts, en_lengths, zh_lengths, band = 25, boundary_weight = 2.0):
+    """
+        monotonic alignment of the translated sentences to the cues by banded dynamic programming, Gale-Church style.
+        Cue j takes k >= 0 sentences; the cost of the step adds
+            boundary_weight * |k - counts[j]|, the boundary evidence, and
+            gale_church_cost of the chars of the k sentences against the English chars of the sentences ended in cue j.
+        Only the states within band sentences of the position expected from the counts are kept, so the time is
+        O(len(counts) * band); the band is doubled if no path fits in it.
+        Args:
+            counts: list of int, sentence ends in each cue, see SentenceSegmenter.count
+            en_lengths: list of int, English chars of the sentences ended in each cue, 0 if none ends in it
+            zh_lengths: list of int, chars of each translated sentence
+            band: int, half width of the band, in sentences
+            boundary_weight: float, the cost of taking one sentence more or less than counted
+        Return: (list, list)
+            list of (int, int), the [start, end) of the sentences taken by each cue
+            list of float, the confidence of each cue, exp(-cost of its step), 1.0 is a perfect match
+    """
+    m = len(counts)
+    n = len(zh_lengths)
+    total_counts = sum(counts)
+    total_en = sum(en_lengths)
+    total_zh = sum(zh_lengths)
+    ratio = float(total_zh) / total_en if total_en > 0 and total_zh > 0 else 1.0  # 1.0 for an empty translation, the variance must not be 0
+    variance = 3.0 * ratio  # variance of the translated chars for one English char
+    en_floor = max(float(total_en) / total_counts if total_counts > 0 else 1.0, 1.0)  # an average sentence, so k > 0 on a cue without any sentence end is not impossible
+    cum_zh = [0]
+    for length in zh_lengths:
+        cum_zh.append(cum_zh[-1] + length)
+    expected = []  # expected number of sentences taken after each cue
+    cum_counts = 0
+    for count in counts:
+        cum_counts += count
+        expected.append(n * cum_counts // total_counts if total_counts > 0 else n)
+
+    def step_cost(j, i, k):
+        zh = cum_zh[i + k] - cum_zh[i]
+        en = en_lengths[j]
+        delta = (zh - ratio * en) / math.sqrt(variance * max(en, en_floor))
+        return boundary_weight * abs(k - counts[j]) + gale_church_cost(delta)
+
+    while True:
+        costs = {0: 0.0}
+        backs = []  # for each cue: dict, state -> (previous state, cost of the step)
+        for j in range(m):
+            lo = max(0, expected[j] - band)
+            hi = min(n, expected[j] + band)
+            new_costs = {}
+            back = {}
+            for i, cost in costs.items():
+                for k in range(0, min(counts[j] + 2, n - i) + 1):
+                    i2 = i + k
+                    if i2 < lo or i2 > hi:
+                        continue
+                    step = step_cost(j, i, k)
+                    if not i2 in new_costs or cost + step < new_costs[i2]:
+                        new_costs[i2] = cost + step
+                        back[i2] = (i, step)
+            if len(new_costs) == 0:
+                break
+            costs = new_costs
+            backs.append(back)
+        if len(backs) == m or band >= n:
+            break
+        band *= 2
+        print('align_sentences: no path within the band, retry with band = %d' % band)
+
+    # the sentences left after the last state are added to the last cue
+    last = min(costs, key = lambda i: costs[i] + boundary_weight * (n - i))
+    spans = []
+    confidences = []
+    i = last
+    end = n
+    extra = boundary_weight * (n - last)
+    for j in range(m - 1, -1, -1):
+        previous, step = backs[j][i]
+        spans.append((previous, end))
+        confidences.append(math.exp(-(step + extra)))
+        extra = 0.0
+        end = previous
+        i = previous
+    spans.reverse()
+    confidences.reverse()
+    return spans, confidences
+
+
+def english_side(combines):
+    """
+        the sentence ends of the cues for align_sentences, split by segmenter;
+        the same for all the target languages, so it is computed once when there are several
+        Args:
+            combines: list of Cue
+        Return: (list, list), counts and en_lengths, see align_sentences
+    """
+    counts = []
+    en_lengths = []
+    pending = 0  # English chars since the last sentence end
+    for transcript in combines:
+        text = transcript['text']
+        offsets = segmenter.boundaries(text)
+        counts.append(len(offsets))
+        if len(offsets) == 0:
+            en_lengths.append(0)
+            pending += len(text)
+        else:
+            en_lengths.append(pending + offsets[-1])
+            pending = len(text) - offsets[-1]
+    return counts, en_lengths
+
+
+def align_dp(combines, joined_translated_list, band = 25, english = None):
+    """
+        align the translated sentences to the cues with align_sentences
+        Args:
+            combines: list of Cue
+            joined_translated_list: list of str, the translated sentences
+            band: int, see align_sentences
+            english: (list, list), returned by english_side for combines, None to compute it here
+        Return: list of Cue, with cn_subtitle and confidence
+    """
+    counts, en_lengths = english_side(combines) if english is None else english
+    zh_lengths = [len(sentence.strip()) for sentence in joined_translated_list]
+    spans, confidences = align_sentences(counts = counts, en_lengths = en_lengths, zh_lengths = zh_lengths, band = band)
+
+    new_combines = []
+    low = []
+    len_joined = len(joined_translated_list)
+    for transcript, (start, end), confidence in zip(combines, spans, confidences):
+        new_transcript = Cue.from_dict(transcript)  # cn_subtitle is added to the same cue
+        if start == end:  # no sentence ends in the cue, show the sentence going on
+            new_transcript.cn_subtitle = joined_translated_list[start] if start < len_joined else ''
+        else:
+            new_transcript.cn_subtitle = '\r\n'.join(joined_translated_list[start:end])
+        new_transcript.confidence = round(confidence, 3)
+        if confidence < 0.5:
+            low.append(new_transcript.order)
+        new_combines.append(new_transcript)
+    print('accumulated judged sentences en = %d' % sum(counts))
+    print('aligned: %d cues, %d sentences, low confidence cues = %d' %(len(new_combines), len_joined, len(low)))
+    if len(low) > 0:
+        print('low confidence orders: %s' % ', '.join(str(order) for order in low[:20]))
+    return new_combines
+
+
+def split_cue(cue, parts, shared = False):
+    """
+        split an overlong cue into parts cues, the English text and the translation are broken by break_lines into the same number of lines,
+        or into one cue a translated sentence when there are enough of them; the time is shared in proportion to the English chars
+        Args:
+            cue: Cue, with cn_subtitle
+            parts: int, the least number of cues wanted
+            shared: boolean, the translation is the sentence going on in the cues around, so every part shows all of it
+        Return: list of Cue, [cue] if the texts can not be broken into the same number of parts
+    """
+    text = cue.text.strip()
+    cn = cue.cn_subtitle or ''
+    if not shared:
+        parts = max(parts, len(cn.split('\r\n')))
+    en_parts = break_lines(text, max_width = -(-display_width(text) // parts), max_lines = parts).split('\n')
+    if len(en_parts) < 2:
+        return [cue]
+    if shared:
+        cn_parts = [cn] * len(en_parts)
+    else:
+        cn_parts = cn.split('\r\n')
+        if len(cn_parts) != len(en_parts):
+            cn = ''.join(part if char_width(part[-1:] or ' ') == 2 else part + ' ' for part in cn_parts).strip()  # no space after CJK
+            cn_parts = break_lines(cn, max_width = -(-display_width(cn) // len(en_parts)), max_lines = len(en_parts)).split('\n')
+        if len(cn_parts) != len(en_parts):
+            return [cue]
+    total = sum(len(part) for part in en_parts)
+    cues = []
+    start_ms = cue.start_ms
+    chars = 0
+    for en_part, cn_part in zip(en_parts, cn_parts):
+        chars += len(en_part)
+        end_ms = cue.start_ms + (cue.end_ms - cue.start_ms) * chars // total
+        part = Cue(order = cue.order, start_ms = start_ms, end_ms = end_ms, text = ' ' + en_part.strip())
+        part.cn_subtitle = cn_part.strip()
+        part.confidence = cue.confidence
+        cues.append(part)
+        start_ms = end_ms
+    return cues
+
+
+def merge_cues(first, second):
+    """
+        Return: Cue, the two cues shown as one, the translation going on in both is kept once
+    """
+    cue = Cue(order = first.order, start_ms = first.start_ms, end_ms = second.end_ms, text = '%s %s' %(first.text.rstrip(), second.text.strip()))
+    first_cn = first.cn_subtitle or ''
+    second_cn = second.cn_subtitle or ''
+    if first_cn == second_cn or second_cn == '':
+        cue.cn_subtitle = first_cn
+    elif first_cn == '':
+        cue.cn_subtitle = second_cn
+    else:
+        cue.cn_subtitle = '%s\r\n%s' %(first_cn, second_cn)
+    confidences = [confidence for confidence in (first.confidence, second.confidence) if not confidence is None]
+    cue.confidence = min(confidences) if len(confidences) > 0 else None
+    return cue
+
+
+def timeline_lengths(cues):
+    """
+        the chars to read in each cue, a translation going on from the cue before is counted in that cue only
+        Return: (numpy array, numpy array), the English and the translated chars
+    """
+    en = np.fromiter((len(cue.text.strip()) for cue in cues), dtype = np.int64, count = len(cues))
+    target = []
+    previous = None
+    for cue in cues:
+        cn = cue.cn_subtitle or ''
+        target.append(0 if cn == previous else len(cn.replace('\r\n', '')))
+        previous = cn
+    return en, np.array(target, dtype = np.int64)
+
+
+def fix_times(starts, ends, en, target, min_ms = 1000, max_ms = 7000, max_cps = 20.0, max_cps_target = 11.0, gap_ms = 100, stats = None):
+    """
+        the vectorized timing fixes, in this order: the overlaps are removed, a cue shorter than the time needed to read it
+        (min_ms, or the chars of either text over its max chars per second, at most max_ms) is extended up to the next cue and then
+        back to the cue before, the gaps shorter than gap_ms are closed, and no cue lasts longer than max_ms
+        Args:
+            starts, ends: numpy int64 arrays, milliseconds, sorted by starts
+            en, target: numpy int64 arrays, see timeline_lengths
+            stats: dict, the counts of the fixes are added to it
+        Return: (numpy array, numpy array, numpy array), the new starts, ends and the time needed by each cue
+    """
+    if stats is None:
+        stats = {}
+    starts = starts.copy()
+    big = np.iinfo(np.int64).max // 2
+    next_starts = np.append(starts[1:], big)
+    fixed = np.maximum(np.minimum(ends, next_starts), starts)
+    stats['overlaps'] = stats.get('overlaps', 0) + int(np.count_nonzero(fixed < ends))
+    ends = fixed
+
+    need = np.maximum(np.ceil(en * 1000.0 / max_cps), np.ceil(target * 1000.0 / max_cps_target)).astype(np.int64)
+    need = np.minimum(np.maximum(need, min_ms), max_ms)
+    short = ends - starts < need
+    stats['extended'] = stats.get('extended', 0) + int(np.count_nonzero(short))
+    ends = np.where(short, np.maximum(ends, np.minimum(starts + need, next_starts)), ends)
+    shortfall = need - (ends - starts)
+    previous_ends = np.concatenate(([0], ends[:-1]))
+    starts = np.where(shortfall > 0, np.maximum(np.minimum(starts - shortfall, starts), previous_ends), starts)
+
+    gaps = starts[1:] - ends[:-1]
+    closing = (gaps > 0) & (gaps < gap_ms)
+    stats['gaps'] = stats.get('gaps', 0) + int(np.count_nonzero(closing))
+    ends[:-1] = np.where(closing, starts[1:], ends[:-1])
+
+    ends = np.minimum(ends, starts + max_ms)
+    return starts, ends, need
+
+
+def fix_timeline(cues, min_ms = 1000, max_ms = 7000, max_cps = 20.0, max_cps_target = 11.0, gap_ms = 100, max_chars = 84):
+    """
+        the timeline stage: the whisper times are fixed for reading, on numpy arrays of int milliseconds.
+        The cues are sorted by start and each end is cut at the next start, so the cues longer than max_ms can be split (see split_cue)
+        within their own time; then the times are fixed (see fix_times),
+        then a cue still too short for its text is merged with the next one, if the two fit in max_chars English chars and max_ms,
+        and the times are fixed again
+        Args:
+            cues: list of Cue, with cn_subtitle, returned by align_dp or align_greedy; they are not changed
+            min_ms, max_ms: int, the min and max milliseconds of a cue
+            max_cps: float, max English chars per second
+            max_cps_target: float, max translated chars per second
+            gap_ms: int, the gaps between cues shorter than this are closed
+            max_chars: int, max English chars of a merged cue, two lines of 42
+        Return: list of Cue, new cues with the orders from 1
+    """
+    stats = {}
+    cues = sorted(cues, key = lambda cue: cue.start_ms)
+    ends = [min(max(cue.end_ms, cue.start_ms), next_cue.start_ms) for cue, next_cue in zip(cues, cues[1:])] + [max(cue.end_ms, cue.start_ms) for cue in cues[-1:]]
+    stats['overlaps'] = sum(1 for cue, end_ms in zip(cues, ends) if end_ms < cue.end_ms)
+    split = []
+    for i, (cue, end_ms) in enumerate(zip(cues, ends)):
+        copied = Cue(order = cue.order, start_ms = cue.start_ms, end_ms = end_ms, text = cue.text)
+        for key in Cue.optional:
+            setattr(copied, key, getattr(cue, key))
+        duration = end_ms - cue.start_ms
+        if duration > max_ms:
+            shared = cue.cn_subtitle in ((cues[i - 1].cn_subtitle if i > 0 else None), (cues[i + 1].cn_subtitle if i + 1 < len(cues) else None))
+            parts = split_cue(copied, -(-duration // max_ms), shared = shared)
+            if len(parts) > 1:
+                stats['split'] = stats.get('split', 0) + 1
+            split.extend(parts)
+        else:
+            split.append(copied)
+    cues = split
+    if len(cues) == 0:
+        return cues
+
+    options = {'min_ms': min_ms, 'max_ms': max_ms, 'max_cps': max_cps, 'max_cps_target': max_cps_target, 'gap_ms': gap_ms}
+    starts = np.fromiter((cue.start_ms for cue in cues), dtype = np.int64, count = len(cues))
+    ends = np.fromiter((cue.end_ms for cue in cues), dtype = np.int64, count = len(cues))
+    en, target = timeline_lengths(cues)
+    starts, ends, need = fix_times(starts, ends, en, target, stats = stats, **options)
+
+    mergeable = (ends[:-1] - starts[:-1] < need[:-1]) & (starts[1:] - ends[:-1] <= gap_ms) \
+        & (en[:-1] + en[1:] + 1 <= max_chars) & (ends[1:] - starts[:-1] <= max_ms)
+    for cue, start_ms, end_ms in zip(cues, starts.tolist(), ends.tolist()):
+        cue.start_ms = start_ms
+        cue.end_ms = end_ms
+    if mergeable.any():
+        merged = []
+        skip = False
+        for i, cue in enumerate(cues):
+            if skip:
+                skip = False
+                continue
+            if i < len(mergeable) and mergeable[i]:
+                merged.append(merge_cues(cue, cues[i + 1]))
+                skip = True
+            else:
+                merged.append(cue)
+        stats['merged'] = len(cues) - len(merged)
+        cues = merged
+        starts = np.fromiter((cue.start_ms for cue in cues), dtype = np.int64, count = len(cues))
+        ends = np.fromiter((cue.end_ms for cue in cues), dtype = np.int64, count = len(cues))
+        en, target = timeline_lengths(cues)
+        starts, ends, need = fix_times(starts, ends, en, target, **options)
+        for cue, start_ms, end_ms in zip(cues, starts.tolist(), ends.tolist()):
+            cue.start_ms = start_ms
+            cue.end_ms = end_ms
+
+    for order, cue in enumerate(cues, 1):
+        cue.order = order
+    too_fast = int(np.count_nonzero(ends - starts < need))
+    print('timeline: %d cues, split %d, merged %d, extended %d, overlaps removed %d, gaps closed %d, still too fast %d' %(
+        len(cues), stats.get('split', 0), stats.get('merged', 0), stats.get('extended', 0), stats.get('overlaps', 0), stats.get('gaps', 0), too_fast))
+    return cues
+
+
+def to_srt(translated, combines, empty_pairs = True, name = 'sentences_en_cn', out_dir = 'translated', align = 'dp', formats = ('srt',),
+           lang = 'zh-cn', names = None, english = None, timeline = None, english_outputs = True):
     """
         Args:
             translated: list
@@ -619,10 +2837,18 @@ def to_srt(translated, combines, empty_pairs = True, name = 'sentences_en_cn'):
             combines:  list
             empty_pairs: boolean, if the pairs list is empty, it is true
             name: str, will be used as the filename of the translated en_cn srt file, txt_en_cn
+            out_dir: str, the output directory
+            align: str, 'dp' for align_dp, 'greedy' for align_greedy
+            formats: list of str, the subtitle formats to write, see write_subtitles
+            lang: str, the target language, to choose the sentence split, see split_sentences
+            names: (str, str), the filenames without extension of the translated only and of the bilingual subtitles,
+                default None for ('<name>_cn', '<name>')
+            english: (list, list), returned by english_side for combines, None to compute it in align_dp
+            timeline: dict, the arguments of fix_timeline for the translated subtitles, None to keep the whisper times
+            english_outputs: boolean, default True, write transcripts_en.srt too; False when it is written once for all the languages, see write_english
     """
-    out_dir = 'translated'
     if not os.path.exists(out_dir):
-        os.mkdir(out_dir)    
+        os.makedirs(out_dir)    
     # combines = to_combine()
 
     # write to srt files
@@ -630,11 +2856,13 @@ def to_srt(translated, combines, empty_pairs = True, name = 'sentences_en_cn'):
     srt_origin = os.path.join(out_dir, 'transcripts_en.srt')
     srt_cn = os.path.join(out_dir, 'transcripts_cn.srt')
     srt_en_cn = os.path.join(out_dir, 'transcripts_en_cn.srt')
-    write_srt2(file_name = srt_origin, _dict = combines, order = 'order', start = 'in', end = 'out', text = 'text')
+    outputs = [{'file_name': srt_origin, 'text': 'text'}] if english_outputs else []
     if not empty_pairs:
-        write_srt2(file_name = srt_cn, _dict = combines, order = 'order', start = 'in', end = 'out', text = 'target')  
         # that is the translation line by line, which is usually meaningless, for the source English text may not be a complete sentence in a line.
-        write_srt2(file_name = srt_en_cn, _dict = combines, order = 'order', start = 'in', end = 'out', text = 'text', text_second = 'target')                     
+        outputs.append({'file_name': srt_cn, 'text': 'target'})
+        outputs.append({'file_name': srt_en_cn, 'text': 'text', 'text_second': 'target'})
+    with profiler.stage('write', cpu = True):
+        write_subtitles(_dict = combines, outputs = expand_formats(outputs, formats), order = 'order', start = 'in', end = 'out')
 
     txt_en_cn = os.path.join(out_dir, '%s_text_en_cn.txt' % name)
     with open(txt_en_cn, 'w', encoding='utf-8') as writer:
@@ -667,20 +2895,8 @@ def to_srt(translated, combines, empty_pairs = True, name = 'sentences_en_cn'):
         for transcript in transcripts
     ]
     joined_translated_all = ' '.join(joined_translateds)  # the full translated text
-    # it might be risky that, some . will be replaced by mistake.
-    pattern = re.compile(r'\D\.\D')  # sometimes Google Translation gets "这是上一句子.这是下一句子。"
-    should_not_dots = re.findall(pattern, joined_translated_all)
-    for should_not_dot in unique_list(should_not_dots):
-        # make sure only one . in should_not_dots
-        pattern = should_not_dot.replace('.', '\.')  # for . match any char, that is not what we expect
-        repl = should_not_dot.replace('.', '。')
-        joined_translated_all = re.sub(pattern, repl, joined_translated_all)
-    joined_translated_all_tmp = joined_translated_all.replace('。', '。\n').replace('？', '？\n').replace('……', '……\n').replace('！', '！\n').replace('......', '......\n') # ......  # the Chinese …… maps English ...
-    joined_translated_list = joined_translated_all_tmp.split('\n')  # split into sentences list, # the last one is empty,  the result for 'what\n'.split('\n') is ['waht', '']
-    if joined_translated_list[-1] == '':
-        joined_translated_list = joined_translated_list[:-1]
-
-    len_joined = len(joined_translated_list)
+    with profiler.stage('split', cpu = True):
+        joined_translated_list, spans = split_sentences(joined_translated_all, lang = lang)
     print('joined translated sentences = %d' % len(joined_translated_list))  
     
     txt_joined_translated = os.path.join(out_dir, 'translated.txt')
@@ -690,63 +2906,743 @@ def to_srt(translated, combines, empty_pairs = True, name = 'sentences_en_cn'):
             ct += 1
             writer.writelines('%d: %s\r\n' %(ct, text))
 
-    len_combines = len(combines) # the number of lines in original whisper srt
-    # normally len(joined_translated_list) is smaller than/equal to/greater than len(combines)
-    new_combines = []
-    i = 0
-    c = 0
-    cc= 0
-    all_processed = True
-    logged = False
-    for transcript in combines:     
-        # print('%s - %s: %s' %(transcript['in'], transcript['out'], transcript['text']))
-        # order = transcript['order']
-        # print(order)
-        c += 1
-        new_transcript = copy.deepcopy(transcript)
-        
-        # judge how many sentence
-        #text = transcript['target']
-        text = transcript['text']
-        counts = judge_sentence_en_2(text)
-        cc += counts
-        # print('loop c = %d: joined translated index i / len = %d / %d, accumulated judge sentence cc = %d, current line count = %d' %(c, i, len_joined, cc, counts))
-        if i > len_joined - 1:
-            all_processed = False
-            if not logged:
-                logged = True
-                logs = 'processed / original whisper srt = %d / %d' % (c - 1, len_combines)
-            continue  # temporary solution; to continue to static sentences en, not break
-        if counts == 0:
-            new_transcript['cn_subtitle'] = joined_translated_list[i]
+    with profiler.stage('align', cpu = True):
+        if align == 'greedy':
+            new_combines = align_greedy(combines = combines, joined_translated_list = joined_translated_list)
         else:
-            cn_subtitle = ''
-            for j in range(counts):
-                if i > len_joined - 1:
-                    all_processed = False
-                    logs_j = 'out of index while adding up sentences. i = %d' % i
-                    logs = 'processed / original whisper srt = %d / %d' % (c - 1, len_combines)
-                    print(logs_j)
-                    break
-                if cn_subtitle == '':
-                    cn_subtitle = joined_translated_list[i]
-                else:
-                    cn_subtitle = '\r\n'.join([cn_subtitle, joined_translated_list[i]])
-                i += 1
-            new_transcript['cn_subtitle'] = cn_subtitle        
-        new_combines.append(new_transcript)
-    print('accumulated judged sentences en = %d' % cc)
-    if all_processed:
-        print('all processed.')
-    else:
-        print(logs)
+            new_combines = align_dp(combines = combines, joined_translated_list = joined_translated_list, english = english)
+    if not timeline is None:
+        with profiler.stage('timeline', cpu = True):
+            new_combines = fix_timeline(new_combines, **timeline)
     json_new_combine = os.path.join(out_dir, 'sentences_translated.json')
     dump_json(_file = json_new_combine, _dict = new_combines)
   
-    srt_cn_sentences = os.path.join(out_dir, '%s_cn.srt' % name)   # cn lang only srt
-    srt_en_cn_sentences = os.path.join(out_dir, '%s.srt' % name)   # en cn double langs srt
-    write_srt2(file_name = srt_cn_sentences, _dict = new_combines, order = 'order', start = 'in', end = 'out', text = 'cn_subtitle', break_sub = True)
-    write_srt2(file_name = srt_en_cn_sentences, _dict = new_combines, order = 'order', start = 'in', end = 'out', text = 'text', text_second = 'cn_subtitle')
+    if names is None:
+        names = ('%s_cn' % name, name)
+    srt_cn_sentences = os.path.join(out_dir, '%s.srt' % names[0])   # cn lang only srt
+    srt_en_cn_sentences = os.path.join(out_dir, '%s.srt' % names[1])   # en cn double langs srt
+    outputs = [
+        {'file_name': srt_cn_sentences, 'text': 'cn_subtitle', 'break_sub': True},
+        {'file_name': srt_en_cn_sentences, 'text': 'text', 'text_second': 'cn_subtitle'}
+    ]
+    with profiler.stage('write', cpu = True):
+        write_subtitles(_dict = new_combines, outputs = expand_formats(outputs, formats), order = 'order', start = 'in', end = 'out')
+
+
+def get_nameonly(json_whisper):
+    """
+        "xxx.f140.json" to "xxx", used as the output srt filename
+    """
+    basename = os.path.basename(json_whisper)
+    nameonly = re.sub(r'\.\w+$', '', basename)  # remove .m4a from xxx.f140.m4a
+    return re.sub(r'\.\w+$', '', nameonly)  # remove .f140 from  xxx.f140
+
+
+def prepare_whisper(json_whisper, out_dir = 'translated', fmt_dir = '', chars_limit = 10000, resume = True, stream = False):
+    """
+        the stages before translation: parse, standardize and group the whisper json
+        Args:
+            json_whisper: str, path to the whisper json
+            out_dir: str, the output directory
+            fmt_dir: str, the directory for the formatted copy of the whisper json
+            chars_limit: int, see transform_whisper
+            resume: boolean, default True, load the outputs of the stages not changed since the last run, see Manifest
+            stream: boolean, default False, see load_whisper, the formatted copy has only the kept fields then
+        Return: (list, list), the standardized cues and the groups to translate
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    manifest = Manifest(os.path.join(out_dir, 'manifest.json'))
+    source_key = hash_json([hash_file(json_whisper), code_hash()])
+    transform_key = hash_json([source_key, chars_limit])
+    # json_whisper_std is the standardized original source which is used to combine translated transcripts
+    json_whisper_std = os.path.join(out_dir, 'whisper_std.json')
+    json_transfrom = os.path.join(out_dir, 'transform.json')
+    basename = os.path.basename(json_whisper)
+    nameonly = re.sub(r'\.\w+$', '', basename)
+    json_whisper_fmt = os.path.join(fmt_dir, '%s_fmt.json' % nameonly)
+
+    whisper_dict = None
+    if resume and manifest.fresh('standardize', source_key, [json_whisper_std, json_whisper_fmt]):
+        print('standardize: up to date, loaded %s' % json_whisper_std)
+        with open(json_whisper_std, 'r') as fp:
+            whispers = [Cue.from_dict(info) for info in json.load(fp)]
+    else:
+        with profiler.stage('parse', cpu = True):
+            whisper_dict = load_whisper(json_whisper, stream = stream)  # parsed once, shared by the following stages
+            dump_json(_file = json_whisper_fmt, _dict = whisper_dict)    # just format the whisper output for further manually check    
+        with profiler.stage('standardize', cpu = True):
+            whispers = standardize_whisper_dict(whisper_dict = whisper_dict)   
+            dump_json(_file = json_whisper_std, _dict = whispers)
+        manifest.update('standardize', source_key)
+
+    if resume and manifest.fresh('transform', transform_key, [json_transfrom]):
+        print('transform: up to date, loaded %s' % json_transfrom)
+        with open(json_transfrom, 'r') as fp:
+            infos = json.load(fp)
+    else:
+        if whisper_dict is None:
+            with profiler.stage('parse', cpu = True):
+                whisper_dict = load_whisper(json_whisper, stream = stream)
+        with profiler.stage('transform', cpu = True):
+            infos = transform_whisper_dict(whisper_dict = whisper_dict, chars_limit = chars_limit)
+            dump_json(_file = json_transfrom, _dict = infos)
+        manifest.update('transform', transform_key)
+    return whispers, infos
+
+
+def translate_whisper(infos, nameonly, out_dir = 'translated', resume = True, trans_list = False, backend = None, src = 'en', dest = 'zh-cn', **kwargs):
+    """
+        the translation stage, every chunk is checkpointed in out_dir/checkpoints as soon as it is translated,
+        so a failed run resumes from the first chunk not translated yet
+        Args:
+            infos: list, returned by prepare_whisper
+            nameonly: str, the output filename
+            out_dir: str, the output directory
+            resume: boolean, default True, skip the stage if its input did not change, and reuse the chunk checkpoints
+            the others are passed to translate
+        Return: (list, list), see translate
+    """
+    if backend is None:
+        backend = GoogleTransBackend()
+    manifest = Manifest(os.path.join(out_dir, 'manifest.json'))
+    json_pairs = os.path.join(out_dir, 'translated_pairs.json')
+    json_translated = os.path.join(out_dir, '%s_translated.json' % nameonly)
+    key = hash_json([infos, trans_list, backend.name, src, dest])
+    outputs = [json_translated, json_pairs] if trans_list else [json_translated]
+    if resume and manifest.fresh('translate', key, outputs):
+        print('translate: up to date, loaded %s' % json_translated)
+        with open(json_translated, 'r') as fp:
+            new_infos = json.load(fp)
+        pairs = []
+        if trans_list:
+            with open(json_pairs, 'r') as fp:
+                pairs = json.load(fp)
+        return new_infos, pairs
+
+    checkpoint_dir = os.path.join(out_dir, 'checkpoints')
+    if not resume and os.path.exists(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+    with profiler.stage('translate'):
+        new_infos, pairs = translate(infos, trans_list = trans_list, backend = backend, src = src, dest = dest, checkpoint_dir = checkpoint_dir, **kwargs)
+    dump_json(_file = json_translated, _dict = new_infos)
+    if len(pairs) > 0:
+        dump_json(_file = json_pairs, _dict = pairs)
+    manifest.update('translate', key)
+    return new_infos, pairs
+
+
+def finish_whisper(new_infos, pairs, whispers, nameonly, out_dir = 'translated', resume = True, align = 'dp', formats = ('srt',),
+                   lang = 'zh-cn', names = None, english = None, timeline = None, english_outputs = True):
+    """
+        the stages after translation: combine and write the srt files
+        Args:
+            new_infos: list, translated groups returned by translate
+            pairs: list, returned by translate
+            whispers: list, returned by prepare_whisper
+            nameonly: str, the output srt filename
+            out_dir: str, the output directory
+            resume: boolean, default True, skip the stages whose inputs did not change
+            align: str, see to_srt
+            formats: list of str, see to_srt
+            lang, names, english, timeline, english_outputs: see to_srt, without english_outputs combines_translated.json is not written either
+        Return: int, the number of cues
+    """
+    if names is None:
+        names = ('%s_cn' % nameonly, nameonly)
+    manifest = Manifest(os.path.join(out_dir, 'manifest.json'))
+    combine_key = hash_json([whispers, pairs, code_hash()])
+    srt_key = hash_json([combine_key, new_infos, nameonly, align, formats, lang, names, timeline, english_outputs])
+    json_combine = os.path.join(out_dir, 'combines_translated.json')
+    srt_outputs = [
+        os.path.join(out_dir, '%s.%s' %(file_name, fmt))
+        for file_name in (['transcripts_en'] if english_outputs else []) + list(names)
+        for fmt in formats
+    ]
+    if resume and manifest.fresh('combine', combine_key, [json_combine] if english_outputs else []) and manifest.fresh('srt', srt_key, srt_outputs):
+        print('combine, srt: up to date')
+        return len(whispers)
+
+    # combine translated transcripts with the original ones
+    with profiler.stage('combine', cpu = True):
+        if english_outputs:
+            combines, empty_pairs = to_combine(transcripts = whispers, pairs = pairs, out_dir = out_dir)   # return (list, boolean)
+        else:
+            combines, empty_pairs = combine_lists(transcripts = whispers, pairs = pairs)
+    manifest.update('combine', combine_key)
+    # write to srt files
+    to_srt(translated = new_infos, combines = combines, empty_pairs = empty_pairs, name = nameonly, out_dir = out_dir, align = align, formats = formats,
+           lang = lang, names = names, english = english, timeline = timeline, english_outputs = english_outputs)
+    manifest.update('srt', srt_key)
+    return len(combines)
+
+
+def write_english(whispers, out_dir = 'translated', resume = True, formats = ('srt',)):
+    """
+        write the outputs of the source side once for all the target languages: combines_translated.json and transcripts_en.srt
+        Args:
+            whispers: list, returned by prepare_whisper
+            out_dir: str, the output directory
+            resume: boolean, default True, skip it if the whispers did not change
+            formats: list of str, see write_subtitles
+    """
+    manifest = Manifest(os.path.join(out_dir, 'manifest.json'))
+    english_key = hash_json([whispers, formats, code_hash()])
+    json_combine = os.path.join(out_dir, 'combines_translated.json')
+    srt_origin = os.path.join(out_dir, 'transcripts_en.srt')
+    outputs = expand_formats([{'file_name': srt_origin, 'text': 'text'}], formats)
+    if resume and manifest.fresh('english', english_key, [json_combine] + [output['file_name'] for output in outputs]):
+        print('english: up to date')
+        return
+    with profiler.stage('combine', cpu = True):
+        combines, _ = to_combine(transcripts = whispers, pairs = [], out_dir = out_dir)
+    with profiler.stage('write', cpu = True):
+        write_subtitles(_dict = combines, outputs = outputs, order = 'order', start = 'in', end = 'out')
+    manifest.update('english', english_key)
+
+
+def target_names(nameonly, src, dest):
+    """
+        the filenames without extension of the translated only and of the bilingual subtitles for a target language
+        other than the default one: <name>.<dest> and <name>.<src>-<dest>
+        Return: (str, str)
+    """
+    return ('%s.%s' %(nameonly, dest), '%s.%s-%s' %(nameonly, src, dest))
+
+
+def single_names(args, nameonly):
+    """
+        the subtitle filenames for the modes with one target language: the default ones for zh-cn, else see target_names
+    """
+    return None if args.dest == ['zh-cn'] else target_names(nameonly, args.src, args.dest[0])
+
+
+def timeline_options(args):
+    """
+        the arguments of fix_timeline from the command line, None without --timeline
+    """
+    if not args.timeline:
+        return None
+    return {
+        'min_ms': args.min_duration,
+        'max_ms': args.max_duration,
+        'max_cps': args.max_cps,
+        'max_cps_target': args.max_cps_target,
+        'gap_ms': args.gap
+    }
+
+
+def process_pool(workers):
+    """
+        a process pool for finish_whisper, started by forkserver, or spawn where there is no forkserver.
+        The pool is used while translation threads are running, and a forked worker could inherit a lock one of them holds, such as profiler.lock
+    """
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context(method))
+
+
+def translate_fanout(args, whispers, infos, nameonly, out_dir = 'translated', resume = True, cache = None, backend = None, sizer = None, dedup = None):
+    """
+        translate into all the args.dest languages, each into out_dir/<lang>/, see target_names for the filenames.
+        The English side (the cues, the chunks and their sentence ends, see english_side) is computed once for all the languages,
+        and its files are written once in out_dir (see write_english) while the languages are translated.
+        The languages are translated concurrently in threads sharing the rate limit, cache and backend;
+        the split, alignment and writing of each language runs in a process pool as soon as its translation is done.
+        Args:
+            whispers, infos: returned by prepare_whisper
+        Return: dict, lang -> the number of cues, None if the language failed
+    """
+    english = english_side(whispers)
+    limiter = RateLimiter(rate = args.rate)  # shared by all the languages
+    results = {}
+
+    def failed(lang, future):
+        try:
+            return future.result()
+        except Exception as e:
+            print('%s failed: %s' %(lang, format(e)))
+            results[lang] = None
+            return None
+
+    with process_pool(max(min(args.jobs, len(args.dest)), 1)) as pool, ThreadPoolExecutor(max_workers = len(args.dest)) as translators:
+        translations = {
+            translators.submit(translate_whisper, infos, nameonly = nameonly, out_dir = os.path.join(out_dir, lang), resume = resume,
+                               src = args.src, dest = lang, workers = args.workers, limiter = limiter, cache = cache, backend = backend,
+                               sizer = sizer, dedup = dedup): lang
+            for lang in args.dest
+        }
+        write_english(whispers, out_dir = out_dir, resume = resume, formats = args.formats)
+        finishes = {}
+        for future in as_completed(translations):
+            lang = translations[future]
+            result = failed(lang, future)
+            if result is None:
+                continue
+            new_infos, pairs = result
+            lang_dir = os.path.join(out_dir, lang)
+            future = pool.submit(profiled_call, finish_whisper, cpu = profiler.cpu, cpu_file = os.path.join(lang_dir, 'profile_cpu_finish.prof'),
+                                 new_infos = new_infos, pairs = pairs, whispers = whispers, nameonly = nameonly, out_dir = lang_dir,
+                                 resume = resume, align = args.align, formats = args.formats, lang = lang,
+                                 names = target_names(nameonly, args.src, lang), english = english, timeline = timeline_options(args),
+                                 english_outputs = False)
+            finishes[future] = lang
+        for future in as_completed(finishes):
+            lang = finishes[future]
+            result = failed(lang, future)
+            if not result is None:
+                cues, snapshot = result
+                profiler.merge(snapshot)
+                results[lang] = cues
+    for lang in args.dest:
+        print('%s: %s' %(lang, 'failed' if results.get(lang) is None else '%d cues' % results[lang]))
+    return results
+
+
+def find_inputs(pattern):
+    """
+        Args:
+            pattern: str, a directory (all its .json files) or a glob
+        Return: list of str, the whisper json files, the _fmt.json copies written by this script are skipped
+    """
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.json')
+    return sorted(
+        path
+        for path in glob.glob(pattern, recursive = True)
+        if os.path.isfile(path) and not path.endswith('_fmt.json')
+    )
+
+
+def run_batch(args, backend, cache, sizer = None, dedup = None):
+    """
+        translate many whisper json files, each file gets its own output directory translated/<name>/.
+        The parsing, grouping, combining and srt writing run in a process pool; translation runs in threads of this process,
+        so all files share one rate limit, cache, backend, chunk sizer and deduplicator.
+        Return: list of dict, the summary for each file
+    """
+    jobs = []
+    names = set()
+    for json_whisper in find_inputs(args.batch):
+        nameonly = get_nameonly(json_whisper)
+        name = nameonly
+        i = 1
+        while name in names:  # the same name from different directories
+            i += 1
+            name = '%s_%d' % (nameonly, i)
+        names.add(name)
+        out_dir = os.path.join('translated', name)
+        jobs.append({
+            'file': json_whisper,
+            'name': nameonly,
+            'out_dir': out_dir,
+            'cues': 0,
+            'chunks': 0,
+            'chars': 0,
+            'status': 'ok',
+            'start': time.time()
+        })
+    if len(jobs) == 0:
+        print('no whisper json found: %s' % args.batch)
+        return []
+
+    limiter = RateLimiter(rate = args.rate)  # shared by all the files
+
+    def failed(job, future):
+        try:
+            return future.result()
+        except BaseException as e:
+            job['status'] = 'failed: %s' % format(e)
+            print('%s %s' %(job['file'], job['status']))
+            return None
+
+    with ProcessPoolExecutor(max_workers = max(args.jobs, 1)) as pool, ThreadPoolExecutor(max_workers = max(args.jobs, 1)) as translators:
+        prepares = {
+            pool.submit(profiled_call, prepare_whisper, cpu = profiler.cpu, cpu_file = os.path.join(job['out_dir'], 'profile_cpu_prepare.prof'),
+                        json_whisper = job['file'], out_dir = job['out_dir'], fmt_dir = job['out_dir'], chars_limit = args.chars_limit,
+                        resume = not args.fresh, stream = args.stream): job
+            for job in jobs
+        }
+        translations = {}
+        for future in as_completed(prepares):
+            job = prepares[future]
+            result = failed(job, future)
+            if result is None:
+                continue
+            (whispers, infos), snapshot = result
+            profiler.merge(snapshot)
+            job['chunks'] = len(infos)
+            job['chars'] = sum(info['chars'] for info in infos)
+            future = translators.submit(translate_whisper, infos, nameonly = job['name'], out_dir = job['out_dir'], resume = not args.fresh,
+                                        src = args.src, dest = args.dest[0], workers = args.workers, limiter = limiter, cache = cache, backend = backend,
+                                        sizer = sizer, dedup = dedup)
+            translations[future] = (job, whispers)
+        finishes = {}
+        for future in as_completed(translations):
+            job, whispers = translations[future]
+            result = failed(job, future)
+            if result is None:
+                continue
+            new_infos, pairs = result
+            future = pool.submit(profiled_call, finish_whisper, cpu = profiler.cpu, cpu_file = os.path.join(job['out_dir'], 'profile_cpu_finish.prof'),
+                                 new_infos = new_infos, pairs = pairs, whispers = whispers, nameonly = job['name'], out_dir = job['out_dir'],
+                                 resume = not args.fresh, align = args.align, formats = args.formats, lang = args.dest[0], names = single_names(args, job['name']),
+                                 timeline = timeline_options(args))
+            finishes[future] = job
+        for future in as_completed(finishes):
+            job = finishes[future]
+            result = failed(job, future)
+            if not result is None:
+                cues, snapshot = result
+                profiler.merge(snapshot)
+                job['cues'] = cues
+                job['seconds'] = time.time() - job['start']
+
+    print('%-40s %8s %8s %10s %8s  %s' %('file', 'cues', 'chunks', 'chars', 'seconds', 'status'))
+    for job in jobs:
+        seconds = job.get('seconds', time.time() - job['start'])
+        print('%-40s %8d %8d %10d %8.1f  %s' %(job['file'], job['cues'], job['chunks'], job['chars'], seconds, job['status']))
+    return jobs
+
+
+class Service(object):
+    """
+        the long running mode for --watch and --serve: one backend, cache and chunk sizer stay warm for all the jobs.
+        Jobs wait in a bounded queue and are translated one by one, each into translated/jobs/<name>_<hash of the path>/,
+        so a file submitted again resumes from its own manifest and checkpoints.
+        Args:
+            args: the parsed arguments
+            backend: TranslatorBackend
+            cache: TranslationCache, None for no cache
+            sizer: AdaptiveSizer, None for not adaptive
+    """
+    def __init__(self, args, backend, cache = None, sizer = None):
+        self.args = args
+        self.backend = backend
+        self.cache = cache
+        self.sizer = sizer
+        self.queue = queue.Queue(maxsize = max(args.queue_size, 1))
+        self.jobs = {}  # id -> job dict
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def submit(self, json_whisper):
+        """
+            Return: dict, the queued job; None if the queue is full
+        """
+        nameonly = get_nameonly(json_whisper)
+        path_hash = hashlib.sha1(os.path.abspath(json_whisper).encode('utf-8')).hexdigest()[:8]
+        with self.lock:
+            job = {
+                'id': len(self.jobs) + 1,
+                'file': json_whisper,
+                'name': nameonly,
+                'out_dir': os.path.join('translated', 'jobs', '%s_%s' %(nameonly, path_hash)),
+                'status': 'queued',
+                'cues': 0,
+                'submitted': time.time()
+            }
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                return None
+            self.jobs[job['id']] = job
+        print('job %d queued: %s' %(job['id'], json_whisper))
+        return job
+
+    def update(self, job, **changes):
+        """
+            change the job under the lock, the server threads copy it under the lock too
+        """
+        with self.lock:
+            job.update(changes)
+
+    def run_job(self, job):
+        args = self.args
+        self.update(job, status = 'running')
+        start = time.time()
+        cues = 0
+        try:
+            whispers, infos = prepare_whisper(json_whisper = job['file'], out_dir = job['out_dir'], fmt_dir = job['out_dir'],
+                                              chars_limit = args.chars_limit, stream = args.stream)
+            dedup = Deduplicator()  # per job, the cache keeps the translations between the jobs
+            new_infos, pairs = translate_whisper(infos, nameonly = job['name'], out_dir = job['out_dir'], src = args.src, dest = args.dest[0],
+                                                 workers = args.workers, rate = args.rate, cache = self.cache, backend = self.backend, sizer = self.sizer, dedup = dedup)
+            dedup.report()
+            cues = finish_whisper(new_infos = new_infos, pairs = pairs, whispers = whispers, nameonly = job['name'], out_dir = job['out_dir'],
+                                  align = args.align, formats = args.formats, lang = args.dest[0], names = single_names(args, job['name']),
+                                  timeline = timeline_options(args))
+            status = 'done'
+        except Exception as e:
+            status = 'failed: %s' % format(e)
+        seconds = time.time() - start
+        self.update(job, status = status, cues = cues, seconds = seconds)
+        if self.sizer is not None:
+            self.sizer.save()
+        print('job %d %s: %s, %d cues, %.1f seconds' %(job['id'], status, job['file'], cues, seconds))
+
+    def work(self):
+        while not self.stopped.is_set():
+            try:
+                job = self.queue.get(timeout = 1)
+            except queue.Empty:
+                continue
+            self.run_job(job)
+            self.queue.task_done()
+
+    def watch(self, in_dir):
+        """
+            scan in_dir every args.poll seconds, a new or changed file is queued once its size and time are the same in two scans,
+            so a file still being written is not taken
+        """
+        seen = {}  # path -> (mtime, size) queued
+        pending = {}  # path -> (mtime, size) of the last scan
+        while not self.stopped.is_set():
+            for path in find_inputs(in_dir):
+                try:
+                    stat = os.stat(path)
+                except OSError:  # removed since the scan
+                    continue
+                signature = (stat.st_mtime, stat.st_size)
+                if seen.get(path) == signature:
+                    continue
+                if pending.get(path) != signature:
+                    pending[path] = signature
+                    continue
+                if self.submit(path) is None:  # full, try again at the next scan
+                    continue
+                seen[path] = signature
+                del pending[path]
+            self.stopped.wait(self.args.poll)
+
+    def make_server(self, port):
+        """
+            Return: http.server.ThreadingHTTPServer, bound to 127.0.0.1:port
+        """
+        service = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def reply(self, code, body, headers = None):
+                data = json.dumps(body, cls = ComplexEncoder).encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                body = None
+                with service.lock:  # copies, the worker thread changes the jobs while they are serialized
+                    if parts == ['jobs']:
+                        body = [dict(job) for job in service.jobs.values()]
+                    elif len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit() and int(parts[1]) in service.jobs:
+                        body = dict(service.jobs[int(parts[1])])
+                if body is None:
+                    return self.reply(404, {'error': 'not found'})
+                self.reply(200, body)
+
+            def do_POST(self):
+                if self.path.strip('/') != 'jobs':
+                    return self.reply(404, {'error': 'not found'})
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    json_whisper = json.loads(self.rfile.read(length).decode('utf-8'))['file']
+                except (ValueError, KeyError, TypeError):
+                    return self.reply(400, {'error': 'expected {"file": path}'})
+                if not isinstance(json_whisper, str) or json_whisper == '':
+                    return self.reply(400, {'error': 'expected {"file": path}'})
+                if not os.path.isfile(json_whisper):
+                    return self.reply(404, {'error': 'file not found: %s' % json_whisper})
+                job = service.submit(json_whisper)
+                if job is None:
+                    return self.reply(503, {'error': 'queue full'}, headers = {'Retry-After': str(int(max(service.args.poll, 1)))})
+                with service.lock:
+                    job = dict(job)
+                self.reply(202, job)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        return http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+
+    def run(self):
+        """
+            run until interrupted or terminated, the running job is finished and the queued ones are dropped then
+        """
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stopped.set())
+        worker = threading.Thread(target = self.work, daemon = True)
+        worker.start()
+        server = None
+        if self.args.serve is not None:
+            server = self.make_server(self.args.serve)
+            threading.Thread(target = server.serve_forever, daemon = True).start()
+            print('serving on http://127.0.0.1:%d/jobs' % self.args.serve)
+        try:
+            if self.args.watch is not None:
+                print('watching %s' % self.args.watch)
+                self.watch(self.args.watch)
+            else:
+                while not self.stopped.wait(1):  # a plain wait() would not see KeyboardInterrupt
+                    pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print('stopping, %d jobs not started' % self.queue.qsize())
+            self.stopped.set()
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            worker.join()
+
+
+def read_live(source, segments, poll = 0.2):
+    """
+        read whisper segments, one json per line, into the segments queue, None is put at the end.
+        A file is followed as it grows, until interrupted; stdin is read until closed.
+        Args:
+            source: str, path to the file, or '-' for stdin
+            segments: queue.Queue, bounded, so a slow translator holds the reader back instead of filling the memory
+            poll: float, seconds to wait for a growing file
+    """
+    fp = sys.stdin if source == '-' else open(source, 'r', encoding = 'utf-8')
+    line = ''
+    try:
+        while True:
+            part = fp.readline()
+            if part == '':
+                if source == '-':
+                    break
+                time.sleep(poll)
+                continue
+            line += part
+            if not line.endswith('\n'):  # the rest is not written yet
+                continue
+            line, text = '', line.strip()
+            if not text:
+                continue
+            try:
+                segment = json.loads(text)
+            except ValueError:
+                print('live: not a json line: %s' % text[:80])
+                continue
+            segments.put((segment, time.monotonic()))
+    finally:
+        if fp is not sys.stdin:
+            fp.close()
+        segments.put(None)
+
+
+def live_cues(segments, translate_kwargs, latency = 3.0, chars_limit = 10000, deadline = 10.0, in_flight = 4):
+    """
+        translate the segments of read_live in micro chunks, closed at a sentence end (see is_sentence_end),
+        when the first segment of the chunk waited latency seconds, or at chars_limit.
+        Each chunk is translated, split and aligned on its own, so the memory does not grow with the broadcast.
+        A chunk whose translation fails or takes longer than deadline is given out with its source text as cn_subtitle, and the reading goes on.
+        The late translations can not be stopped, so at most in_flight of them run; while there are that many,
+        the next chunks are given out untranslated at once instead of waiting in a queue that would grow with the broadcast.
+        Args:
+            segments: queue.Queue, filled by read_live
+            translate_kwargs: dict, passed to translate, such as backend, cache and limiter
+            latency: float, seconds
+            chars_limit: int
+            deadline: float, seconds to wait for the translation of a chunk
+            in_flight: int, max translations running, the late ones included
+        Return: generator of Cue, with cn_subtitle, in order
+    """
+
+    def translate_chunk(cues, chars):
+        cues = [Cue(order = cue.order, start_ms = cue.start_ms, end_ms = cue.end_ms, text = cue.text) for cue in cues]  # not changed after the deadline
+        texts = [cue.text for cue in cues]
+        infos = [make_group(to_trans = texts, chars = chars - 1, end_order = cues[-1].order)]
+        new_infos, _ = translate(infos, **translate_kwargs)
+        sentences, _ = split_sentences(new_infos[0]['joined_translated'], lang = translate_kwargs.get('dest', 'zh-cn'))
+        return align_dp(combines = cues, joined_translated_list = sentences)
+
+    translators = ThreadPoolExecutor(max_workers = in_flight)  # a translation past its deadline keeps running, the next chunks do not wait for it
+    running = set()
+    cues = []
+    arrivals = []
+    chars = 0
+    order = 0
+    done = False
+    while not done:
+        timeout = None if len(arrivals) == 0 else max(arrivals[0] + latency - time.monotonic(), 0)
+        try:
+            item = segments.get(timeout = timeout)
+        except queue.Empty:
+            item = False  # the deadline of the chunk
+        except KeyboardInterrupt:
+            item = None
+        if item is None:
+            done = True
+        elif item is not False:
+            segment, arrival = item
+            order += 1
+            cues.append(Cue(order = order, start_ms = seconds_to_ms(seconds = segment['start']), end_ms = seconds_to_ms(seconds = segment['end']), text = segment['text']))
+            arrivals.append(arrival)
+            chars += len(segment['text']) + 1
+            if not is_sentence_end(segment['text']) and chars < chars_limit:
+                continue
+        if len(cues) == 0:
+            continue
+
+        running = set(future for future in running if not future.done())
+        try:
+            if len(running) >= in_flight:
+                raise RuntimeError('%d late translations still running' % len(running))
+            future = translators.submit(translate_chunk, cues, chars)
+            running.add(future)
+            try:
+                aligned = future.result(timeout = deadline)
+            except Exception:
+                future.cancel()  # only if it has not started
+                raise
+        except Exception as e:
+            print('live: cues %d-%d not translated: %s' %(cues[0].order, cues[-1].order, format(e) or 'no translation in %.1f seconds' % deadline))
+            profiler.count('untranslated_cues', len(cues))
+            for cue in cues:
+                cue.cn_subtitle = cue.text.strip()  # an empty line would end the srt cue
+            aligned = cues
+        for cue, arrival in zip(aligned, arrivals):
+            profiler.observe('cue_latency', time.monotonic() - arrival)
+            yield cue
+        cues = []
+        arrivals = []
+        chars = 0
+    translators.shutdown(wait = False)
+
+
+def run_live(args, backend, cache = None, sizer = None):
+    """
+        the --live mode: the bilingual and Chinese subtitles are written to translated/live/ cue by cue, flushed as soon as aligned
+    """
+    out_dir = os.path.join('translated', 'live')
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    name = 'live' if args.live == '-' else get_nameonly(args.live)
+    names = single_names(args, name) or ('%s_cn' % name, name)
+    outputs = [
+        {'file_name': os.path.join(out_dir, '%s.srt' % names[0]), 'text': 'cn_subtitle', 'break_sub': True},
+        {'file_name': os.path.join(out_dir, '%s.srt' % names[1]), 'text': 'text', 'text_second': 'cn_subtitle'}
+    ]
+    segments = queue.Queue(maxsize = 1000)
+    threading.Thread(target = read_live, args = (args.live, segments), daemon = True).start()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # stop like Ctrl-C, the buffered segments are still written
+    translate_kwargs = {
+        'workers': 1,
+        'cache': cache,
+        'backend': backend,
+        'src': args.src,
+        'dest': args.dest[0],
+        'limiter': RateLimiter(rate = args.rate),
+        'sizer': sizer
+    }
+    print('live: reading %s, writing %s' %(args.live, out_dir))
+    write_subtitles(_dict = live_cues(segments, translate_kwargs, latency = args.live_latency, chars_limit = args.chars_limit,
+                                      deadline = args.live_deadline),
+                    outputs = expand_formats(outputs, args.formats), flush = True)
 
 
 def main():
@@ -755,6 +3651,46 @@ def main():
     in_dir = ''
 
     args = parse_args()
+    profiler.cpu = args.profile and args.cprofile
+    cache = None
+    for path in (args.cache if not args.no_cache else '', args.chunk_sizes):
+        cache_dir = os.path.dirname(path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+    if not args.no_cache:
+        cache = TranslationCache(path = args.cache, max_bytes = args.cache_size * 1024 * 1024)
+    backend = make_backend(args)
+    dedup = Deduplicator()  # one for the run, shared by all the files in the batch mode
+    sizer = None
+    if args.chunk_sizes:
+        # the live requests are a few cues each, they are not saved as the sizes learned for the chunks
+        sizer = AdaptiveSizer(path = args.chunk_sizes if args.live is None else None, backend = backend, size = args.chars_limit,
+                              latency_budget = args.latency_budget)
+    try:
+        if args.live is not None:
+            run_live(args = args, backend = backend, cache = cache, sizer = sizer)
+        elif args.watch is not None or args.serve is not None:
+            Service(args = args, backend = backend, cache = cache, sizer = sizer).run()
+        elif args.batch is None:
+            translate_one(args = args, cache = cache, backend = backend, sizer = sizer, dedup = dedup, in_dir = in_dir)
+        else:
+            run_batch(args = args, backend = backend, cache = cache, sizer = sizer, dedup = dedup)
+    finally:
+        dedup.report()
+        if sizer is not None:
+            sizer.save()
+        backend.close()
+        if cache is not None:
+            profiler.count('cache_size_bytes', cache.size)
+            cache.close()
+    if args.profile:
+        profiler.dump(out_dir = 'translated')
+
+
+def translate_one(args, cache, backend, sizer = None, dedup = None, in_dir = ''):
+    """
+        translate the single --source file into translated/
+    """
     json_arg = args.source
     json_default =  os.path.join(in_dir, 'whisper.json')
     json_file = None
@@ -772,53 +3708,39 @@ def main():
         print('input json file not found: %s' % json_whisper)
         return
     
-    basename = os.path.basename(json_whisper)
-    # extension = re.findall(r'\.\w+$', basename)
-    nameonly = re.sub(r'\.\w+$', '', basename)  # remove .m4a from xxx.f140.m4a
-    json_whisper_fmt = os.path.join(in_dir, '%s_fmt.json' % nameonly)
-    with open(json_whisper, 'r') as fp:
-        whisper_dict = json.load(fp)
-    dump_json(_file = json_whisper_fmt, _dict = whisper_dict)    # just format the whisper output for further manually check    
-    nameonly = re.sub(r'\.\w+$', '', nameonly)  # the nameonly will be used as output srt filename. remove .f140 from  xxx.f140
-
+    nameonly = get_nameonly(json_whisper)  # the nameonly will be used as output srt filename
     out_dir = 'translated'
-    if not os.path.exists(out_dir):
-        os.mkdir(out_dir)
-    whispers = standardize_whisper(json_whisper = json_whisper)   
-
-    # json_whisper_std is the standardized original source which is used to combine translated transcripts
-    json_whisper_std = os.path.join(out_dir, 'whisper_std.json')
-    dump_json(_file = json_whisper_std, _dict = whispers)
-
-    infos = transform_whisper(json_whisper=json_whisper, chars_limit = 10000)
-    json_transfrom = os.path.join(out_dir, 'transform.json')
-    dump_json(_file = json_transfrom, _dict = infos)
-
-    # google translate
-    # for the broken sentences in original source, the translated sentences are not accurated and usually meaningless, so it is no need to trans_list
-    # we will prefer joining original texts and then spliting the translated texts to match the original ones
-    new_infos, pairs = translate(infos)  # trans_list default False, and pairs will be returned empty
-    json_pairs = os.path.join(out_dir, 'translated_pairs.json')
-    json_translated = os.path.join(out_dir, '%s_translated.json' % nameonly)
-    dump_json(_file = json_translated, _dict = new_infos)
-    if len(pairs) > 0:
-        dump_json(_file = json_pairs, _dict = pairs)
+    resume = not args.fresh
+    whispers, infos = prepare_whisper(json_whisper = json_whisper, out_dir = out_dir, fmt_dir = in_dir, chars_limit = args.chars_limit, resume = resume, stream = args.stream)
+
+    if args.dest != ['zh-cn']:
+        translate_fanout(args = args, whispers = whispers, infos = infos, nameonly = nameonly, out_dir = out_dir, resume = resume,
+                         cache = cache, backend = backend, sizer = sizer, dedup = dedup)
+        trans_srts = [
+            os.path.join(out_dir, lang, '%s.srt' % target_names(nameonly, args.src, lang)[0])
+            for lang in args.dest
+        ]
+    else:
+        # google translate
+        # for the broken sentences in original source, the translated sentences are not accurated and usually meaningless, so it is no need to trans_list
+        # we will prefer joining original texts and then spliting the translated texts to match the original ones
+        new_infos, pairs = translate_whisper(infos, nameonly = nameonly, out_dir = out_dir, resume = resume, src = args.src,
+                                             workers = args.workers, rate = args.rate, cache = cache, backend = backend, sizer = sizer, dedup = dedup)  # trans_list default False, and pairs will be returned empty
+        finish_whisper(new_infos = new_infos, pairs = pairs, whispers = whispers, nameonly = nameonly, out_dir = out_dir, resume = resume, align = args.align, formats = args.formats,
+                       timeline = timeline_options(args))
+        trans_srts = [os.path.join(out_dir, '%s.srt' % nameonly)]
 
-    # combine translated transcripts with the original ones
-    combines, empty_pairs = to_combine(json_transcripts = json_whisper_std, json_pairs = json_pairs)   # return (list, boolean)
-    # write to srt files
-    to_srt(translated = new_infos, combines = combines, empty_pairs = empty_pairs, name = nameonly)
     # copy os.path.join(out_dir, '%s.srt' % nameonly) to current directory
     whisper_srt = os.path.join(in_dir, '%s.srt' % nameonly)
     if os.path.exists(whisper_srt):  # rename the whisper srt, if source lang is English, it is English srt
         os.rename(whisper_srt, '%s_whisper.srt' % nameonly)
-    trans_srt = os.path.join(out_dir, '%s.srt' % nameonly)
-    if os.path.exists(trans_srt):
-        try:
-            shutil.copy(trans_srt, '.')
-        except BaseException as e:
-            print('Fail to copy %s, error = %s' %(trans_srt, format(e)))
+    for trans_srt in trans_srts:
+        if os.path.exists(trans_srt):
+            try:
+                shutil.copy(trans_srt, '.')
+            except BaseException as e:
+                print('Fail to copy %s, error = %s' %(trans_srt, format(e)))
 
     
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()